@@ -0,0 +1,101 @@
+import json
+import logging
+import os
+import pickle
+import threading
+from functools import lru_cache
+from typing import Dict
+
+import numpy as np
+import shapely
+from dotenv import load_dotenv
+from projection import WGS84_CRS, project_coordinates
+from shapely.geometry import LineString, Polygon
+
+"""
+city boundary of hamburg, loaded once per process in every coordinate reference system it is needed in
+
+the coordinates of each variant are kept in a small binary cache file next to the geojson, so later runs neither
+parse the geojson nor project the boundary again. the cache is invalidated when the geojson changes
+"""
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+logger.addHandler(logging.StreamHandler())
+
+load_dotenv()
+
+HAMBURG_BOUNDARY_FILEPATH = "resources/hamburg_boundary.geojson"
+BOUNDARY_CACHE_FILEPATH = os.getenv("BOUNDARY_CACHE_FILEPATH") or "./resources/hamburg_boundary.cache"
+
+
+class Boundary:
+    """ the boundary in one coordinate reference system as prepared polygon, line and index over its segments """
+
+    def __init__(self, coordinates: np.ndarray):
+        # (n, 2) array of x/lon and y/lat
+        self.coordinates = coordinates
+        self.polygon = Polygon(coordinates)
+        self.line = LineString(coordinates)
+        shapely.prepare(self.polygon)
+        shapely.prepare(self.line)
+        self.segments = shapely.linestrings(np.stack([coordinates[:-1], coordinates[1:]], axis=1))
+        self.segment_tree = shapely.STRtree(self.segments)
+
+
+@lru_cache(maxsize=None)
+def hamburg_boundary(crs: str = WGS84_CRS) -> Boundary:
+    return Boundary(boundary_coordinates(crs))
+
+
+def boundary_coordinates(crs: str = WGS84_CRS) -> np.ndarray:
+    """ coordinates of the boundary in :crs, read from the cache file if it is up to date """
+    source_stat = _source_stat()
+    cached_coordinates = _read_cache(source_stat)
+    if crs in cached_coordinates:
+        return cached_coordinates[crs]
+
+    if WGS84_CRS in cached_coordinates:
+        coordinates = cached_coordinates[WGS84_CRS]
+    else:
+        with open(HAMBURG_BOUNDARY_FILEPATH) as f:
+            hamburg_boundary_geojson = json.load(f)
+        logger.info("Loaded boundary of Hamburg")
+        coordinates = np.asarray(hamburg_boundary_geojson['geometries'][0]['coordinates'][0][0], dtype=np.float64)
+        cached_coordinates[WGS84_CRS] = coordinates
+
+    if crs != WGS84_CRS:
+        coordinates = np.column_stack(project_coordinates(coordinates[:, 0], coordinates[:, 1], WGS84_CRS, crs))
+        cached_coordinates[crs] = coordinates
+
+    _write_cache(source_stat, cached_coordinates)
+    return coordinates
+
+
+def _source_stat():
+    stat = os.stat(HAMBURG_BOUNDARY_FILEPATH)
+    return os.path.abspath(HAMBURG_BOUNDARY_FILEPATH), stat.st_size, stat.st_mtime_ns
+
+
+def _read_cache(source_stat) -> Dict[str, np.ndarray]:
+    if not os.path.exists(BOUNDARY_CACHE_FILEPATH):
+        return dict()
+    try:
+        with open(BOUNDARY_CACHE_FILEPATH, "rb") as f:
+            cache = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return dict()
+    if cache.get("source") != source_stat:
+        return dict()
+    return cache["coordinates"]
+
+
+def _write_cache(source_stat, coordinates: Dict[str, np.ndarray]):
+    # written to a separate file first, so concurrently running processes and threads never read a partial cache
+    tmp_file_path = f"{BOUNDARY_CACHE_FILEPATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_file_path, "wb") as f:
+            pickle.dump({"source": source_stat, "coordinates": coordinates}, f)
+        os.replace(tmp_file_path, BOUNDARY_CACHE_FILEPATH)
+    except OSError as e:
+        logger.warning(f"Could not write boundary cache {BOUNDARY_CACHE_FILEPATH}: {e}")
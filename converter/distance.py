@@ -0,0 +1,74 @@
+import time
+
+import numpy as np
+
+from projection import METRIC_CRS, WGS84_CRS, project_coordinates
+
+"""
+distances between coordinates given as numpy arrays (or scalars), all results are in meters
+
+arguments broadcast against each other like any numpy operation, so one point can be compared with many points
+at once. distance_matrix compares every point of one set with every point of another set
+"""
+
+# mean earth radius in meters, the same as used by utils.haversine
+EARTH_RADIUS = 6_371_000
+
+
+def haversine_distance(lon1, lat1, lon2, lat2) -> np.ndarray:
+    """ great circle distance between coordinates in decimal degrees """
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def equirectangular_distance(lon1, lat1, lon2, lat2) -> np.ndarray:
+    """ approximation of the haversine distance, accurate for the short distances within a city """
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    x = (lon2 - lon1) * np.cos((lat1 + lat2) / 2)
+    return EARTH_RADIUS * np.hypot(x, lat2 - lat1)
+
+
+def planar_distance(x1, y1, x2, y2) -> np.ndarray:
+    """ euclidean distance between coordinates already projected to a metric crs """
+    return np.hypot(np.subtract(x2, x1), np.subtract(y2, y1))
+
+
+def projected_distance(lon1, lat1, lon2, lat2, crs: str = METRIC_CRS) -> np.ndarray:
+    """ euclidean distance after projecting the coordinates in decimal degrees to the metric :crs """
+    x1, y1 = project_coordinates(*np.broadcast_arrays(lon1, lat1), WGS84_CRS, crs)
+    x2, y2 = project_coordinates(*np.broadcast_arrays(lon2, lat2), WGS84_CRS, crs)
+    return planar_distance(x1, y1, x2, y2)
+
+
+def distance_matrix(lons1, lats1, lons2, lats2, metric=haversine_distance) -> np.ndarray:
+    """ distances between all points of the first and all points of the second set, of shape (len1, len2) """
+    lons1, lats1 = np.asarray(lons1, dtype=float)[:, np.newaxis], np.asarray(lats1, dtype=float)[:, np.newaxis]
+    lons2, lats2 = np.asarray(lons2, dtype=float)[np.newaxis, :], np.asarray(lats2, dtype=float)[np.newaxis, :]
+    return metric(lons1, lats1, lons2, lats2)
+
+
+def benchmark(pair_count: int = 1_000_000):
+    """ compare the scalar utils.haversine with the array kernels """
+    from utils import haversine
+
+    rng = np.random.default_rng(0)
+    lons1, lons2 = rng.uniform(9.7, 10.3, (2, pair_count))
+    lats1, lats2 = rng.uniform(53.4, 53.7, (2, pair_count))
+
+    start_time = time.perf_counter()
+    scalar = [haversine(*pair) for pair in zip(lons1.tolist(), lats1.tolist(), lons2.tolist(), lats2.tolist())]
+    scalar_seconds = time.perf_counter() - start_time
+    print(f"utils.haversine, one call per pair: {scalar_seconds:.3f}s")
+
+    for metric in (haversine_distance, equirectangular_distance, projected_distance):
+        start_time = time.perf_counter()
+        distances = metric(lons1, lats1, lons2, lats2)
+        seconds = time.perf_counter() - start_time
+        max_difference = np.abs(distances - np.array(scalar) * 1000).max()
+        print(f"{metric.__name__}: {seconds:.3f}s ({scalar_seconds / seconds:.0f}x faster, "
+              f"max difference {max_difference:.4f}m)")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -1,21 +1,57 @@
+import os
+from typing import Iterator, Optional
+
+from dotenv import load_dotenv
 from lxml import etree
+from lxml.etree import Element
+from osm_writer import write_osm_elements
+from utils import get_bool_variable
+
+load_dotenv()
+
+# tags osm2pgsql needs to keep nodes which only specify a location
+WAY_NODE_TAGS = (("name", "way_node"),)
+
+# if set, the transformation writes a copy of the transformed drn with tagged nodes right away
+WRITE_TAGGED_DRN = get_bool_variable("WRITE_TAGGED_DRN", False)
+TAGGED_DRN_FILEPATH = os.getenv("TAGGED_DRN_FILEPATH") or "./resources/drn_as_osm_tagged.osm"
 
 
-def insert_node_tag(osm_file_path):
+def insert_node_tag(osm_file_path: str, tagged_file_path: Optional[str] = None):
     """
-    given an osm file path open it and set on each node a name tag if not done yet
-    this is done because osm2psql would ignore nodes that only specify a location
+    given an osm file path set on each node a name tag and write the result to :tagged_file_path, or back to
+    :osm_file_path if not given. this is done because osm2psql would ignore nodes that only specify a location
     without additional information
+
+    the file is streamed element by element, so memory usage doesn't depend on its size
     """
+    tagged_file_path = tagged_file_path or osm_file_path
+    base, extension = os.path.splitext(tagged_file_path)
+    tmp_file_path = f"{base}.tmp{extension}"
+
+    context = etree.iterparse(osm_file_path, events=("start", "end"))
+    _, root = next(context)
+    write_osm_elements(tmp_file_path, _tagged_elements(context, root), dict(root.attrib))
+    os.replace(tmp_file_path, tagged_file_path)
+
 
-    osm_xml_data = etree.parse(osm_file_path)
+def _tagged_elements(context, root: Element) -> Iterator[Element]:
+    for event, element in context:
+        if event != "end" or element.getparent() is not root:
+            continue
+        if element.tag == "node":
+            for key, value in WAY_NODE_TAGS:
+                etree.SubElement(element, "tag", k=key, v=value)
+        yield element
+        # drop elements once they are written
+        element.clear()
+        while element.getprevious() is not None:
+            del root[0]
 
-    root = osm_xml_data.getroot()
-    for node_element in root.iterchildren(tag="node"):
-        etree.SubElement(node_element, "tag", k="name", v="way_node")
 
-    tree = root.getroottree()
-    tree.write(osm_file_path, encoding='utf-8', xml_declaration=True, pretty_print=True)
+def is_tagged_copy_current(osm_file_path: str, tagged_file_path: str = TAGGED_DRN_FILEPATH) -> bool:
+    """ whether the tagged copy exists and was written after :osm_file_path """
+    return os.path.exists(tagged_file_path) and os.path.getmtime(tagged_file_path) >= os.path.getmtime(osm_file_path)
 
 
 if __name__ == '__main__':
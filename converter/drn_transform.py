@@ -1,15 +1,27 @@
 import datetime
 import logging
-import re
-import subprocess
-from collections import defaultdict
-from typing import List, Set, Tuple
-
+import multiprocessing
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from distance import haversine_distance
+from drn_insert_node_tag import TAGGED_DRN_FILEPATH, WAY_NODE_TAGS, WRITE_TAGGED_DRN
 from epsg_converter import Converter
+from feature_parser import (DRN_PROJECTION, OSM_PROJECTION, FeatureAttributes,
+                            FeatureGeometry, parse_feature,
+                            parse_feature_members, strip_namespaces)
+from feature_store import GEOMETRY_MISSING, GEOMETRY_VALID, FeatureGeometryStore
+from instrumentation import add_counters, count, span
 from lxml import etree
 from lxml.etree import Element
 from mapping import *
-from utils import get_bool_variable, haversine
+from osm_ids import OccupiedOsmIds
+from osm_store import OsmDataStore, Tags
+from osm_writer import write_osm_elements
+from utils import get_bool_variable
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -26,36 +38,45 @@ DRN_FILEPATH = os.getenv('DRN_FILEPATH')
 TRANSFORMED_DRN_FILEPATH = os.getenv("TRANSFORMED_DRN_FILEPATH")
 ENABLE_TRAVELLING_ONEWAY = get_bool_variable("ENABLE_TRAVELLING_ONEWAY")
 ONEWAY_TRAVEL_BY_SETTING_MAX_SPEED = get_bool_variable("ONEWAY_TRAVEL_BY_SETTING_MAX_SPEED")
+STREAM_DRN_GML = get_bool_variable("STREAM_DRN_GML", True)
 OSM_RESULT_FILE_PATH = os.getenv("OSM_FILEPATH") or "./resources/osm_with_hamburg_cut_out_medium.osm"
+# processes parsing features in parallel, 1 parses them in the main process
+TRANSFORM_WORKERS = int(os.getenv("TRANSFORM_WORKERS") or os.cpu_count() or 1)
+# features sent to a worker process at once
+TRANSFORM_CHUNK_SIZE = 500
 
-def transform_drn_to_osm(occupied_osm_ids: Set[int]):
+def transform_drn_to_osm(occupied_osm_ids: OccupiedOsmIds):
     transformer = MapTransformer(DRN_FILEPATH, occupied_osm_ids)
     transformer.transform()
-    transformer.write_osm_tree_to_file()
+    transformer.write_osm_tree_to_file(tagged_file_path=TAGGED_DRN_FILEPATH if WRITE_TAGGED_DRN else None)
 
 
 class MapTransformer:
     TIMESTAMP = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ')
 
-    def __init__(self, drn_map_file_path: str, occupied_osm_ids: Set[int]):
-        self.drn_tree = etree.parse(drn_map_file_path)
-        self.cleanup_namespaces()
+    def __init__(self, drn_map_file_path: str, occupied_osm_ids: OccupiedOsmIds, streaming: bool = STREAM_DRN_GML,
+                 workers: int = TRANSFORM_WORKERS):
+        self.drn_map_file_path = drn_map_file_path
+        # in streaming mode the gml file is read feature by feature instead of being loaded as a whole
+        self.streaming = streaming
+        self.workers = workers
+        self.drn_tree = None
+        if not streaming:
+            self.drn_tree = etree.parse(drn_map_file_path)
+            self.cleanup_namespaces()
 
-        self.osm_tree = etree.Element("osm", version="0.6", generator="DRN_Map_Transformer")
-        
         self.occupied_osm_ids = occupied_osm_ids
         
         self.current_way_id = 0
         self.current_node_id = 0
         self.current_relation_id = 0
 
-        self.nodes: Dict[Coordinate, Element] = dict()
-        self.nodes_by_own_id: Dict[str, Element] = dict()
-        self.nodes_by_pg_id: Dict[str, Element] = dict()
-
-
-        self.ways: List[Element] = []
-        self.relations: Dict[str, List[str]] = defaultdict(lambda: [])
+        # resulting osm data, kept in compact arrays and only turned into xml when written to file
+        self.store = OsmDataStore()
+        # node ids by coordinate to reuse nodes shared between ways
+        self.nodes: Dict[Coordinate, int] = dict()
+        # way ids by route name
+        self.relations: Dict[str, List[int]] = defaultdict(lambda: [])
         self.bounding_box: BoundingBox = (1000.0, 1000.0, -1000.0, -1000.0)
 
         # mapping source and destination ids to node ids
@@ -63,9 +84,13 @@ class MapTransformer:
         # the coordinates can slightly differ therefore each src/dest id associated
         # with a list of potential nodes
         self.src_target_to_avg_coord: Dict[str, Coordinate] = defaultdict(set)
-        self.src_target_pairs_without_geometry: Dict[Element, Tuple] = dict()
+        self.src_target_pairs_without_geometry: Dict[int, Tuple] = dict()
 
-        self.converter = Converter("epsg:25832", "epsg:4326")
+        self.converter = Converter(DRN_PROJECTION, OSM_PROJECTION)
+        # projected geometry of every feature, filled once and read by all later steps
+        self.geometries = FeatureGeometryStore()
+        # everything else parsed from every feature, by feature index
+        self.feature_attributes: List[FeatureAttributes] = []
 
         self.way_without_geometry_count = 0
         self.total_count = 0
@@ -75,265 +100,197 @@ class MapTransformer:
         self.rounding_coords_max_distance = 0
 
     def cleanup_namespaces(self):
-        for elem in self.drn_tree.getiterator():
-            if not (isinstance(elem, etree._Comment) or isinstance(elem, etree._ProcessingInstruction)):
-                elem.tag = etree.QName(elem).localname
-        etree.cleanup_namespaces(self.drn_tree)
-
-    def get_next_way_id(self) -> str:
-        self.current_way_id += 1
-        while self.current_way_id in self.occupied_osm_ids:
-            self.current_way_id += 1
-        return str(self.current_way_id)
-
-    def get_next_node_id(self) -> str:
-        self.current_node_id += 1
-        while self.current_node_id in self.occupied_osm_ids:
-            self.current_node_id += 1
-        return str(self.current_node_id)
-
-    def get_next_relation_id(self) -> str:
-        self.current_relation_id += 1
-        while self.current_relation_id in self.occupied_osm_ids:
-            self.current_relation_id += 1
-        return str(self.current_relation_id)
-
-    def generate_src_target_to_avg_coordinate_map(self, feature_members):
-        # generate map with src target ids and averaged coordinate
+        strip_namespaces(self.drn_tree.getroot())
+
+    def iter_feature_members(self) -> Iterator[Element]:
+        """ yield each featureMember of the drn dataset, in streaming mode their namespaces aren't stripped yet """
+        if not self.streaming:
+            yield from self.drn_tree.getroot()
+            return
+
+        context = etree.iterparse(self.drn_map_file_path, events=("end",), tag="{*}featureMember")
+        for _, feature_member in context:
+            yield feature_member
+            # free the processed feature and drop already processed siblings so memory stays flat
+            feature_member.clear()
+            parent = feature_member.getparent()
+            while feature_member.getprevious() is not None:
+                del parent[0]
+        del context
+
+    def iter_features(self) -> Iterator[Element]:
+        """ yield the feature contained in each featureMember of the drn dataset """
+        for feature_member in self.iter_feature_members():
+            if self.streaming:
+                strip_namespaces(feature_member)
+            yield feature_member[0]
+
+    def iter_feature_records(self) -> Iterator[Tuple[FeatureGeometry, FeatureAttributes]]:
+        """
+        parse every feature once in document order, with more than one worker the features are sent in chunks
+        to a process pool and the results are consumed in the order they were submitted
+        """
+        if self.workers <= 1:
+            for feature in self.iter_features():
+                yield parse_feature(feature, self.converter)
+            return
+
+        serialized_feature_members = (etree.tostring(feature_member) for feature_member in self.iter_feature_members())
+        # workers are started from a fork server, forking this process directly isn't safe if other threads run
+        start_methods = multiprocessing.get_all_start_methods()
+        mp_context = multiprocessing.get_context("forkserver") if "forkserver" in start_methods else None
+        with ProcessPoolExecutor(self.workers, mp_context=mp_context) as executor:
+            # only a few chunks are in flight so the whole dataset is never held in memory
+            pending = deque()
+            while True:
+                chunk = list(islice(serialized_feature_members, TRANSFORM_CHUNK_SIZE))
+                if len(chunk) > 0:
+                    pending.append(executor.submit(parse_feature_members, chunk))
+                if len(pending) > 0 and (len(chunk) == 0 or len(pending) >= 2 * self.workers):
+                    records, counters = pending.popleft().result()
+                    add_counters(counters)
+                    yield from records
+                elif len(chunk) == 0:
+                    break
+
+    def get_next_way_id(self) -> int:
+        self.current_way_id = self.occupied_osm_ids.next_free_id("way")
+        return self.current_way_id
+
+    def get_next_node_id(self) -> int:
+        self.current_node_id = self.occupied_osm_ids.next_free_id("node")
+        return self.current_node_id
+
+    def get_next_relation_id(self) -> int:
+        self.current_relation_id = self.occupied_osm_ids.next_free_id("relation")
+        return self.current_relation_id
+
+    def generate_src_target_to_avg_coordinate_map(self, records: Iterable[Tuple[FeatureGeometry, FeatureAttributes]]):
+        # keep the parsed geometry and attributes of every feature and generate map with src target ids and averaged coordinate
         print("Preprocessing Src and Target Ids")
         src_target_to_coordinate_set: Dict[str, List] = defaultdict(list)
 
-        for feature_member in feature_members:
-            feature = feature_member[0]
-            geom = feature.findall("geom")
-            if len(geom) == 0:
-                continue
-            src_id = feature.findall("source")[0].text
-            target_id = feature.findall("target")[0].text
-
-            line_string = geom[0][1] if isinstance(geom[0][0], etree._Comment) else geom[0][0]
-            if "NaN" in line_string[0].text:
-                logger.warning(f"Generating src-target to average coordinate map: 'NaN' in line string from source: {src_id} to target: {target_id} -> Skipping feature")
+        for (state, lats, lons), attributes in records:
+            if state == GEOMETRY_VALID:
+                feature_index = self.geometries.append(lats, lons)
+            else:
+                feature_index = self.geometries.append_without_geometry(state)
+            self.feature_attributes.append(attributes)
+            if state != GEOMETRY_VALID:
                 continue
-            # coordinates of points defining the way [lat, lon, lat, lon, ...]
-            positions = line_string[0].text.split(" ")
-            it = iter(positions)
-            curr_coord_in_geometry = 0
-            total_coord_in_geometry = int(len(positions) / 2)
-            for lat_epsg_25832 in it:
-                curr_coord_in_geometry += 1
-                lon_epsg_25832 = next(it)
-                lat_epsg_4326, lon_epsg_4326 = self.converter.convert((float(lat_epsg_25832), float(lon_epsg_25832)))
-                lat_epsg_4326 = round(lat_epsg_4326, 7)
-                lon_epsg_4326 = round(lon_epsg_4326, 7)
-                coord = lat_epsg_4326, lon_epsg_4326
-
-                if curr_coord_in_geometry == 1:
-                    src_id = feature.findall("source")[0].text
-                    src_target_to_coordinate_set[src_id].append(coord)
-                if curr_coord_in_geometry == total_coord_in_geometry:
-                    target_id = feature.findall("target")[0].text
-                    src_target_to_coordinate_set[target_id].append(coord)
+            src_target_to_coordinate_set[attributes.source].append(self.geometries.first(feature_index))
+            src_target_to_coordinate_set[attributes.target].append(self.geometries.last(feature_index))
 
         print("Averaging coordinates")
 
-        for src_target_id, coords in src_target_to_coordinate_set.items():
-            lat_avg = round(sum([coord[0] for coord in coords]) / len(coords), 7)
-            lon_avg = round(sum([coord[1] for coord in coords]) / len(coords), 7)
-
-            # calculate what the maximum distance between rounded coord and actual position
-            max_dist = max([haversine(lon_avg, lat_avg, coord[1], coord[0]) for coord in coords]) * 1000
-            if max_dist > self.rounding_coords_max_distance:
-                self.rounding_coords_max_distance = max_dist
+        # every coordinate next to its rounded average, to compute all distances between them at once
+        coords, avg_coords = [], []
+        for src_target_id, group_coords in src_target_to_coordinate_set.items():
+            lat_avg = round(sum([coord[0] for coord in group_coords]) / len(group_coords), 7)
+            lon_avg = round(sum([coord[1] for coord in group_coords]) / len(group_coords), 7)
+            coords.extend(group_coords)
+            avg_coords.extend([(lat_avg, lon_avg)] * len(group_coords))
 
             self.src_target_to_avg_coord[src_target_id] = (str(lat_avg), str(lon_avg))
 
-    def transform(self):
-        feature_members = self.drn_tree.getroot()
+        # calculate what the maximum distance between rounded coord and actual position
+        if len(coords) > 0:
+            coords, avg_coords = np.array(coords), np.array(avg_coords)
+            max_dist = float(haversine_distance(avg_coords[:, 1], avg_coords[:, 0], coords[:, 1], coords[:, 0]).max())
+            self.rounding_coords_max_distance = max(self.rounding_coords_max_distance, max_dist)
 
-        self.generate_src_target_to_avg_coordinate_map(feature_members)
+    def transform(self):
+        # features are only parsed once, all later steps work on the parsed records
+        with span("parse features", workers=self.workers, streaming=self.streaming):
+            self.generate_src_target_to_avg_coordinate_map(self.iter_feature_records())
         logger.info(f"Maximum rounding distance between coord and rounded coord for source/target id: {self.rounding_coords_max_distance}")
 
-        for feature_member in feature_members:
-            self.parse_element(feature_member[0])
-
-        bb = self.bounding_box
-        etree.SubElement(self.osm_tree, "bounds", minlat=str(bb[0]), minlon=str(bb[1]), maxlat=str(bb[2]), maxlon=str(bb[3]))
-
-        for node in self.nodes.values():
-            self.osm_tree.append(node)
-
-        for way in self.ways:
-            self.osm_tree.append(way)
+        with span("build ways"):
+            for feature_index, attributes in enumerate(self.feature_attributes):
+                self.parse_element(attributes, feature_index)
+            count("drn nodes", len(self.store.nodes))
+            count("drn ways", len(self.store.ways))
 
         for name, members in self.relations.items():
-            relation = etree.Element("relation", id=self.get_next_relation_id(), version="1", timestamp=self.TIMESTAMP)
-            for member in members:
-                etree.SubElement(relation, "member", {"type": "way", "ref": member, "role": ""})
             # tags to mark the bicycle route
-            etree.SubElement(relation,  "tag", {"k": "name", "v": name})
-            etree.SubElement(relation,  "tag", {"k": "type", "v": "route"})
-            etree.SubElement(relation, "tag", {"k": "route", "v": "bicycle"})
-            etree.SubElement(relation, "tag", {"k": "network", "v": "lcn"})
-            etree.SubElement(relation,  "tag", {"k": "lcn", "v": "yes"})
-
-            self.osm_tree.append(relation)
+            tags = (("name", name), ("type", "route"), ("route", "bicycle"), ("network", "lcn"), ("lcn", "yes"))
+            self.store.relations.add(self.get_next_relation_id(), [("way", member, "") for member in members], tags)
 
         logger.info(f"No highway was set and now using default: {self.no_highway_count}")
         logger.info(f"Without geometry: {self.way_without_geometry_count} total: {self.total_count} percentage: {self.way_without_geometry_count * 1.0 / (self.total_count * 1.0)}")
         logger.info(f"Never referenced: {self.never_referenced_count}")
 
-    def parse_element(self, feature: Element):
+    def parse_element(self, attributes: FeatureAttributes, feature_index: int):
         self.total_count += 1
-        copy_way = False
-
-        way = etree.Element("way", id=self.get_next_way_id(), version="1", timestamp=self.TIMESTAMP)
-
-        self._parse_geometry(way, feature)
-
-        # Check if we need to skip this feature first.
-        for element in feature:
-            if "zeitbeschraenkung" in element.tag:
-                # If the element contains a time restriction, we need to throw it away.
-                # GraphHopper supports time restrictions through the oneway:conditional tag,
-                # but only for date ranges, not for time ranges. Furthermore, it may take
-                # the user some time to arrive at this way, meaning that the time restriction
-                # is much more complex and would need a lot of additional work to be implemented.
-                # Due to this reason, we decide to throw away the element.
-                # See https://github.com/priobike/priobike-graphhopper-drn/issues/17
-                logger.warning(f"Discarding time-restricted way: {way.attrib['id']}")
-                return
-
-        for element in feature:
-            if "status" in element.tag:
-                pass
-            elif "strassenname" in element.tag:
-                #way_attributes["name"] = element.text
-                etree.SubElement(way, "tag", {"k": "name", "v": element.text})
-            elif "radweg_art" in element.tag:
-                #tags = radweg_art_to_osm_tags(element.text)
-                #way_attributes.update(tags)
-                for tag, value in radweg_art_to_osm_tags(element.text).items():
-                    etree.SubElement(way, "tag", {"k": tag, "v": value})
-            elif "richtung" == element.tag:
-                for tag, value in richtung_to_osm_tags(element.text).items():
-                    etree.SubElement(way, "tag", {"k": tag, "v": value})
-                    if tag == "oneway" and value == "yes":
-                        copy_way = True
-            elif "oberflaeche" in element.tag:
-                for tag, value in oberflaeche_to_osm_tags(element.text).items():
-                    etree.SubElement(way, "tag", {"k": tag, "v": value})
-            elif "breite" in element.tag:
-                width_str = element.text
-                if float(width_str) >= 50:
-                    width_str = str(float(width_str) / 10.0)
-                etree.SubElement(way, "tag", {"k": "width", "v": width_str})
-            elif "niveau" in element.tag:
-                for tag, value in niveau_to_osm_tags(element.text).items():
-                    etree.SubElement(way, "tag", {"k": tag, "v": value})
-            elif "source" in element.tag or "target" in element.tag:
-                # todo decide if this info is relevant
-                pass
-                # node_id = self.BASE_ID + int(element.text)
-                # if node_id not in self.nodes:
-                #     self.nodes[node_id] = etree.Element("node", id=str(node_id))
-            elif "geom" in element.tag:
-                # already handled
-                pass
-
-            elif "radrouten" == element.tag:
-                routes = element.text.split(", ")
-                way_id = way.attrib["id"]
-                for route in routes:
-                    self.relations[route].append(way_id)
-            elif "fuehrungsart" == element.tag:
-                # uncertain if tags with similar meaning exist in osm
-                pass
-            elif "benutzungspflicht" == element.tag:
-                # todo detect traffic sign from it
-                pass
-
-            # the following remaining attributes are redundant and/or don't add new relevant information
-            # mofa_frei:  is not relevant
-            # hindernis:  information already contained by other tags as "breite" and "radweg_art"
-            elif element.tag in ["klasse", "klasse_id", "netzklasse", "zweirichtung", "mofa_frei", "hindernis", "radweg_in_mittellage"]:
-                pass
-            else:
-                raise ValueError(f"Unknown tag found, was: '{element.tag}' with value '{element.text}'")
 
-        #  check if there are nd elements contained, if not the way must not be added
-        if len(way.findall("nd")) == 0:
+        way_id = self.get_next_way_id()
+        way_node_refs = self._parse_geometry(way_id, attributes, feature_index)
+
+        if attributes.time_restricted:
+            # time restrictions can't be represented for graphhopper, see feature_parser.parse_attributes
+            logger.warning(f"Discarding time-restricted way: {way_id}")
+            return
+
+        for route in attributes.routes:
+            self.relations[route].append(way_id)
+
+        #  check if there are nodes referenced, if not the way must not be added
+        if len(way_node_refs) == 0:
             return
 
+        way_tags = attributes.tags
         # fallback for features not setting a radweg_art and therefore wouldn't set a highway, otherwise
         # it would be excluded by graphhopper
-        if len(feature.findall("radweg_art")) == 0:
-            etree.SubElement(way, "tag", {"k": "highway", "v": "tertiary"})
+        if not attributes.has_radweg_art:
+            way_tags += (("highway", "tertiary"),)
             self.no_highway_count += 1
 
         # one-ways should be allowed as segments where one can dismount to traverse the opposite direction, since not
         # possible with current graphhopper create a duplicated 'virtual' geometry which is a footway on top of the
         # oneway
-        if copy_way and ENABLE_TRAVELLING_ONEWAY and not ONEWAY_TRAVEL_BY_SETTING_MAX_SPEED:
-            way_2 = etree.Element("way", id=self.get_next_way_id(), version="1", timestamp=self.TIMESTAMP)
-            self._parse_geometry(way_2, feature)
-            vals = {"highway": "footway"}
-            for tag, value in vals.items():
-                etree.SubElement(way_2, "tag", {"k": tag, "v": value})
-            self.ways.append(way_2)
+        if attributes.oneway and ENABLE_TRAVELLING_ONEWAY and not ONEWAY_TRAVEL_BY_SETTING_MAX_SPEED:
+            way_2_id = self.get_next_way_id()
+            # all nodes of the feature exist by now, so the footway references the same ones
+            self.store.ways.add(way_2_id, way_node_refs, (("highway", "footway"),))
 
-        self.ways.append(way)
+        self.store.ways.add(way_id, way_node_refs, way_tags)
 
         if self.current_way_id % 10000 == 0:
             logger.debug(f"Finished processing Element, curr wayid: {self.current_way_id}")
 
-    def _parse_geometry(self, way, feature):
-        """ parse a features geometry and enrich the given way by creating nodes referencing it accordingly """
-        geom = feature.findall("geom")
-        if len(geom) > 0:
-            line_string = geom[0][1] if isinstance(geom[0][0], etree._Comment) else geom[0][0]
-            if "NaN" in line_string[0].text:
-                logger.warning(f"Parsing geometry: 'NaN' in line string from source: {feature.findall('source')[0].text} to target: {feature.findall('target')[0].text} -> Skipping feature")
-                return
-            # coordinates of points defining the way [lat, lon, lat, lon, ...]
-            positions = line_string[0].text.split(" ")
-            it = iter(positions)
+    def _parse_geometry(self, way_id: int, attributes: FeatureAttributes, feature_index: int) -> List[int]:
+        """ create nodes for the features stored geometry and return the ids of the nodes referenced by the way """
+        node_refs = []
+        state = self.geometries.state(feature_index)
+        if state == GEOMETRY_VALID:
+            lats_epsg_4326, lons_epsg_4326 = self.geometries.get(feature_index)
             curr_coord_in_geometry = 0
-            total_coord_in_geometry = int(len(positions) / 2)
-            for lat_epsg_25832 in it:
+            total_coord_in_geometry = len(lats_epsg_4326)
+            for lat_epsg_4326, lon_epsg_4326 in zip(lats_epsg_4326, lons_epsg_4326):
                 curr_coord_in_geometry += 1
-                lon_epsg_25832 = next(it)
-
-                lat_epsg_4326, lon_epsg_4326 = self.converter.convert((lat_epsg_25832, lon_epsg_25832))
-                lat_epsg_4326 = round(lat_epsg_4326, 7)
-                lon_epsg_4326 = round(lon_epsg_4326, 7)
                 coord = lat_epsg_4326, lon_epsg_4326
 
                 # source id is only defined for first and last coord in coord list
                 if curr_coord_in_geometry == 1:
-                    src_id = feature.findall("source")[0].text
                     # set the coordinate to the rounded one instead of the one specified through the list of coordinates
-                    coord = self.src_target_to_avg_coord[src_id]
+                    coord = self.src_target_to_avg_coord[attributes.source]
                 if curr_coord_in_geometry == total_coord_in_geometry:
-                    target_id = feature.findall("target")[0].text
-                    coord = self.src_target_to_avg_coord[target_id]
+                    coord = self.src_target_to_avg_coord[attributes.target]
 
-                if coord not in self.nodes:
+                node_id = self.nodes.get(coord)
+                if node_id is None:
                     node_id = self.get_next_node_id()
-                    node = etree.Element("node", id=node_id, version="1", timestamp=self.TIMESTAMP,
-                                         lat=str(lat_epsg_4326), lon=str(lon_epsg_4326))
-
-                    self.nodes[coord] = node
+                    self.store.nodes.add(node_id, lat_epsg_4326, lon_epsg_4326)
+                    self.nodes[coord] = node_id
 
                     self._update_bounding_box(lat_epsg_4326, lon_epsg_4326)
 
-                node_id = self.nodes[coord].attrib["id"]
-                etree.SubElement(way, "nd", {"ref": node_id})
-        else:
+                node_refs.append(node_id)
+        elif state == GEOMETRY_MISSING:
             # there are features that don't define a geometry and therefore can't be used, just keep track of them
             self.way_without_geometry_count += 1
-            src_target = feature.findall("source")[0].text, feature.findall("target")[0].text
-            self.src_target_pairs_without_geometry[way] = src_target
+            self.src_target_pairs_without_geometry[way_id] = attributes.source, attributes.target
+        return node_refs
 
     def _update_bounding_box(self, lat_epsg_4326, lon_epsg_4326):
         """ when parsing a new node it could be that the overall bounding box of the resulting
@@ -345,21 +302,52 @@ class MapTransformer:
             max(self.bounding_box[3], lon_epsg_4326),
         )
 
-    def write_osm_tree_to_file(self):
-        tree = self.osm_tree.getroottree()
-        tree.write(TRANSFORMED_DRN_FILEPATH, encoding='utf-8', xml_declaration=True, pretty_print=True)
-        logger.info("Sort resulting file.")
-        subprocess.run([f'osmium sort {TRANSFORMED_DRN_FILEPATH} -o {TRANSFORMED_DRN_FILEPATH} --overwrite'], shell=True)
-
-def gather_occupied_osm_ids():
-    osm_file_path = OSM_RESULT_FILE_PATH
-    with open(osm_file_path, "r") as file:
-        osm_xml_data = file.read()
-    occupied_ids = re.findall(r"\"[0-9]+\"", osm_xml_data)
-    unique_occupied_ids = set()
-    for id in occupied_ids:
-        unique_occupied_ids.add(int(id.replace("\"", "")))
-    return unique_occupied_ids
+    def to_xml_elements(self, node_tags: Tags = ()) -> Iterator[Element]:
+        """
+        materialize the transformed data as osm xml elements ordered by type and id, one element at a time,
+        :node_tags are added to every node
+        """
+        bb = self.bounding_box
+        yield etree.Element("bounds", minlat=str(bb[0]), minlon=str(bb[1]), maxlat=str(bb[2]), maxlon=str(bb[3]))
+
+        for node_id, lat, lon in self.store.nodes.by_id():
+            node = etree.Element("node", id=str(node_id), version="1", timestamp=self.TIMESTAMP, lat=str(lat), lon=str(lon))
+            _append_tags(node, node_tags)
+            yield node
+
+        for way_id, node_refs, tags in self.store.ways.by_id():
+            way = etree.Element("way", id=str(way_id), version="1", timestamp=self.TIMESTAMP)
+            for node_ref in node_refs:
+                etree.SubElement(way, "nd", {"ref": str(node_ref)})
+            _append_tags(way, tags)
+            yield way
+
+        for relation_id, members, tags in self.store.relations.by_id():
+            relation = etree.Element("relation", id=str(relation_id), version="1", timestamp=self.TIMESTAMP)
+            for member_type, member_ref, role in members:
+                etree.SubElement(relation, "member", {"type": member_type, "ref": str(member_ref), "role": role})
+            _append_tags(relation, tags)
+            yield relation
+
+    def write_osm_tree_to_file(self, file_path: str = TRANSFORMED_DRN_FILEPATH, tagged_file_path: Optional[str] = None):
+        """
+        write the transformed data to :file_path, if :tagged_file_path is given also write a copy with tagged nodes
+        as needed for the import with osm2pgsql, so it doesn't need to be created from the written file later
+        """
+        # elements are emitted ordered by id, so the file doesn't need to be sorted afterwards
+        write_osm_elements(file_path, self.to_xml_elements(), {"version": "0.6", "generator": "DRN_Map_Transformer"})
+        if tagged_file_path is not None:
+            write_osm_elements(tagged_file_path, self.to_xml_elements(WAY_NODE_TAGS),
+                               {"version": "0.6", "generator": "DRN_Map_Transformer"})
+
+
+def _append_tags(element: Element, tags: Tags):
+    for key, value in tags:
+        etree.SubElement(element, "tag", {"k": key, "v": value})
+
+
+def gather_occupied_osm_ids() -> OccupiedOsmIds:
+    return OccupiedOsmIds.from_files(OSM_RESULT_FILE_PATH)
 
 if __name__ == '__main__':
     occupied_osm_ids = gather_occupied_osm_ids()
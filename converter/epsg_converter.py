@@ -1,11 +1,24 @@
 from typing import Tuple
 
-from pyproj import Transformer
+import numpy as np
+from instrumentation import count
+from projection import get_transformer
 
 
 class Converter:
     def __init__(self, origin_projection: str, target_projection: str):
-        self.transformer = Transformer.from_crs(origin_projection, target_projection)
+        self.transformer = get_transformer(origin_projection, target_projection, always_xy=False)
 
     def convert(self, point: Tuple[float, float]):
         return self.transformer.transform(*point)
+
+    def convert_many(self, xs: np.ndarray, ys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """ project whole coordinate arrays with a single call instead of one call per point """
+        xs, ys = np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)
+        count("projected coordinates", xs.size)
+        return self.transformer.transform(xs, ys)
+
+    def convert_pos_list(self, pos_list: str) -> Tuple[np.ndarray, np.ndarray]:
+        """ project a gml posList string of the form "x y x y ..." and return both coordinate arrays """
+        positions = np.array(pos_list.split(), dtype=float)
+        return self.convert_many(positions[0::2], positions[1::2])
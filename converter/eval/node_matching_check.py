@@ -0,0 +1,65 @@
+""" Check that a drn node is replaced by a closer osm node on the second-ranked matched way """
+import os
+import tempfile
+
+import numpy as np
+import shapely
+from lxml import etree
+
+import map_conflation
+from map_conflation import find_replacement_nodes
+from memory_matcher import nearest_lines
+from osm_index import OsmIndex
+from projection import METRIC_CRS, WGS84_CRS, project_coordinates
+
+# drn node at the origin, coordinates are given in meters east and north of it
+ORIGIN = project_coordinates(10.0, 53.6)
+DRN_NODE = (0, 0)
+# the closest way passes 2m away, but its nodes are 100m away from the drn node
+CLOSEST_WAY = {"id": "1", "nodes": {"11": (-100, 2), "12": (100, 2)}}
+# the second closest way passes 5m away and has a node right there
+SECOND_WAY = {"id": "2", "nodes": {"21": (0, 5), "22": (0, 200)}}
+
+
+def to_wgs84(x: float, y: float):
+    lon, lat = project_coordinates(ORIGIN[0] + x, ORIGIN[1] + y, METRIC_CRS, WGS84_CRS)
+    return float(lon), float(lat)
+
+
+def osm_document() -> etree.ElementTree:
+    root = etree.Element("osm", version="0.6")
+    for way in (CLOSEST_WAY, SECOND_WAY):
+        for node_id, position in way["nodes"].items():
+            lon, lat = to_wgs84(*position)
+            etree.SubElement(root, "node", id=node_id, lon=str(lon), lat=str(lat))
+    for way in (CLOSEST_WAY, SECOND_WAY):
+        way_element = etree.SubElement(root, "way", id=way["id"])
+        for node_id in way["nodes"]:
+            etree.SubElement(way_element, "nd", ref=node_id)
+    return etree.ElementTree(root)
+
+
+def check():
+    # matching ranks the closer way first and keeps the second one as well
+    lines = shapely.linestrings([[(ORIGIN[0] + x, ORIGIN[1] + y) for x, y in way["nodes"].values()]
+                                 for way in (CLOSEST_WAY, SECOND_WAY)])
+    point_indices, line_indices, distances = nearest_lines(shapely.points([ORIGIN]), shapely.STRtree(lines))
+    assert point_indices.tolist() == [0, 0], point_indices
+    assert line_indices.tolist() == [0, 1], line_indices
+    assert np.allclose(distances, [2, 5]), distances
+    matches = {"100": [(int(CLOSEST_WAY["id"]), distances[0]), (int(SECOND_WAY["id"]), distances[1])]}
+
+    # the node 5m away on the second way wins over the nodes 100m away on the first way
+    map_conflation.NODE_MATCHES_FILE_PATH = os.path.join(tempfile.mkdtemp(), "node_matches.json")
+    node_replacements = find_replacement_nodes(OsmIndex(osm_document()), {"100": to_wgs84(*DRN_NODE)}, matches)
+    assert node_replacements == {"100": "21"}, node_replacements
+
+    # with only the closest way, as matched before, no osm node is close enough
+    node_replacements = find_replacement_nodes(OsmIndex(osm_document()), {"100": to_wgs84(*DRN_NODE)},
+                                               {"100": matches["100"][:1]})
+    assert node_replacements == {}, node_replacements
+    print("closer node on the second-ranked way is used")
+
+
+if __name__ == '__main__':
+    check()
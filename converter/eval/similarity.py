@@ -1,9 +1,7 @@
 import json
-from functools import partial
 
-import pyproj
+from projection import to_metric
 from shapely.geometry import Point, LineString
-from shapely.ops import transform
 
 routes = {
     "1_Ost_West": [[9.99085153989529, 53.56090651069028], [9.990566309692458, 53.56116265318303],
@@ -267,14 +265,8 @@ def hausdorff_distance():
             coordinates_original = routes[routename]
             coordinates_map_matched = content["paths"][0]["points"]["coordinates"]
 
-            project = partial(
-                pyproj.transform,
-                pyproj.Proj('EPSG:4326'),
-                pyproj.Proj('EPSG:32633'),
-                always_xy=True
-            )
-            ls_original = transform(project, LineString(coordinates_original))
-            ls_map_matched = transform(project, LineString(coordinates_map_matched))
+            ls_original = to_metric(LineString(coordinates_original))
+            ls_map_matched = to_metric(LineString(coordinates_map_matched))
 
             hausdorff = ls_original.hausdorff_distance(ls_map_matched)
             print(f"Hausdorff: {hausdorff}m")
@@ -3,27 +3,25 @@
 """ Measure snapping distances from requested route start and destination to snapped start and destination """
 import random
 
+import numpy as np
 import requests
 
-from utils import haversine
+from distance import haversine_distance
 
 
 def measure():
-    def get_route_dist(start_coord, dest_coord, url):
+    def get_snapped_coords(url):
+        """ lon/lat of the snapped start and destination, None if no route was found """
         route = requests.get(url).json()
         if 'paths' not in route:
-            return -1, -1
-        route_start = route['paths'][0]['points']['coordinates'][0]
-        route_destination = route['paths'][0]['points']['coordinates'][-1]
-
-        dist_start = haversine(start_coord[1], start_coord[0], route_start[0], route_start[1]) * 1000
-        dist_dest = haversine(dest_coord[1], dest_coord[0], route_destination[0], route_destination[1]) * 1000
-        return dist_start, dist_dest
+            return None
+        coordinates = route['paths'][0]['points']['coordinates']
+        return coordinates[0][:2], coordinates[-1][:2]
 
     route_count = 10_000
 
-    total_dist_drn = 0
-    total_dist_osm = 0
+    # lat/lon of requested points and lon/lat of the points snapped by both graphhopper instances
+    requested_coords, snapped_coords_drn, snapped_coords_osm = [], [], []
 
     for i in range(route_count):
 
@@ -31,17 +29,25 @@ def measure():
         dest_coord = get_random_coord_in_hh()
 
         url_drn = f"http://localhost:8989/route?point={start_coord[0]},{start_coord[1]}&point={dest_coord[0]},{dest_coord[1]}&profile=bike_short_fastest&ch.disable=true&locale=de&calc_points=true&instructions=false&points_encoded=false"
-        dist_start_drn, dist_dest_drn = get_route_dist(start_coord, dest_coord, url_drn)
+        snapped_drn = get_snapped_coords(url_drn)
 
 
         url_osm = f"http://localhost:8995/route?point={start_coord[0]},{start_coord[1]}&point={dest_coord[0]},{dest_coord[1]}&profile=bike_short_fastest&ch.disable=true&locale=de&calc_points=true&instructions=false&points_encoded=false"
-        dist_start_osm, dist_dest_osm = get_route_dist(start_coord, dest_coord, url_osm)
+        snapped_osm = get_snapped_coords(url_osm)
 
-        if dist_start_drn == -1 or dist_start_osm == -1:
+        if snapped_drn is None or snapped_osm is None:
             continue
 
-        total_dist_drn += dist_start_drn + dist_dest_drn
-        total_dist_osm += dist_start_osm + dist_dest_osm
+        requested_coords.extend([start_coord, dest_coord])
+        snapped_coords_drn.extend(snapped_drn)
+        snapped_coords_osm.extend(snapped_osm)
+
+    # distances of all snapped points are computed at once
+    requested_coords = np.array(requested_coords).reshape(-1, 2)
+    total_dist_drn, total_dist_osm = [
+        haversine_distance(requested_coords[:, 1], requested_coords[:, 0], snapped[:, 0], snapped[:, 1]).sum()
+        for snapped in (np.array(snapped_coords_drn).reshape(-1, 2), np.array(snapped_coords_osm).reshape(-1, 2))
+    ]
 
     print(f"Average dist drn: {total_dist_drn / (route_count * 2)}")
     print(f"Average dist osm: {total_dist_osm / (route_count * 2)}")
@@ -0,0 +1,233 @@
+import logging
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from epsg_converter import Converter
+from feature_store import GEOMETRY_INVALID, GEOMETRY_MISSING, GEOMETRY_VALID
+from instrumentation import count, counting
+from lxml import etree
+from lxml.etree import Element
+from mapping import (ONEWAY_TAG, niveau_to_osm_tags, oberflaeche_to_osm_tags,
+                     radweg_art_to_osm_tags, richtung_to_osm_tags)
+from osm_store import Tags
+
+"""
+parsing of single drn features into plain records
+
+everything done here only depends on the feature itself, so features can be parsed in any order and in other
+processes. id allocation, node deduplication and relations are left to the MapTransformer which consumes the
+records in document order
+"""
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+logger.addHandler(logging.StreamHandler())
+
+DRN_PROJECTION = "epsg:25832"
+OSM_PROJECTION = "epsg:4326"
+
+# geometry state and rounded latitudes and longitudes of a feature
+FeatureGeometry = Tuple[int, List[float], List[float]]
+
+
+class FeatureAttributes(NamedTuple):
+    source: Optional[str]
+    target: Optional[str]
+    time_restricted: bool
+    # osm tags mapped from the attributes in document order, without the highway fallback
+    tags: Tags
+    # set if the feature is a oneway which might get a reverse footway
+    oneway: bool
+    routes: Tuple[str, ...]
+    has_radweg_art: bool
+
+
+def parse_feature(feature: Element, converter: Converter) -> Tuple[FeatureGeometry, FeatureAttributes]:
+    count("features")
+    return parse_geometry(feature, converter), parse_attributes(feature)
+
+
+def parse_geometry(feature: Element, converter: Converter) -> FeatureGeometry:
+    """ parse, project and round the geometry of a feature """
+    geom = _find_all(feature, "geom")
+    if len(geom) == 0:
+        return GEOMETRY_MISSING, [], []
+
+    line_string = geom[0][1] if isinstance(geom[0][0], etree._Comment) else geom[0][0]
+    if "NaN" in line_string[0].text:
+        logger.warning(f"Parsing geometry: 'NaN' in line string from source: {_first_text(feature, 'source')} to target: {_first_text(feature, 'target')} -> Skipping feature")
+        return GEOMETRY_INVALID, [], []
+
+    # coordinates of points defining the way, projected as a whole
+    lats_epsg_4326, lons_epsg_4326 = converter.convert_pos_list(line_string[0].text)
+    if len(lats_epsg_4326) == 0:
+        return GEOMETRY_INVALID, [], []
+    return (
+        GEOMETRY_VALID,
+        [round(lat, 7) for lat in lats_epsg_4326.tolist()],
+        [round(lon, 7) for lon in lons_epsg_4326.tolist()],
+    )
+
+
+def parse_attributes(feature: Element) -> FeatureAttributes:
+    source = _first_text(feature, "source")
+    target = _first_text(feature, "target")
+    handlers = [attribute_handler(element.tag) for element in feature]
+
+    # Check if we need to skip this feature first.
+    if _time_restriction in handlers:
+        # If the element contains a time restriction, we need to throw it away.
+        # GraphHopper supports time restrictions through the oneway:conditional tag,
+        # but only for date ranges, not for time ranges. Furthermore, it may take
+        # the user some time to arrive at this way, meaning that the time restriction
+        # is much more complex and would need a lot of additional work to be implemented.
+        # Due to this reason, we decide to throw away the element.
+        # See https://github.com/priobike/priobike-graphhopper-drn/issues/17
+        return FeatureAttributes(source, target, True, (), False, (), False)
+
+    way_tags: Tags = ()
+    routes: List[str] = []
+    copy_way = False
+
+    for element, handler in zip(feature, handlers):
+        if handler is None:
+            raise ValueError(f"Unknown tag found, was: '{element.tag}' with value '{element.text}'")
+        if handler is _routes:
+            routes.extend(element.text.split(", "))
+            continue
+        tags = handler(element.text)
+        if handler is richtung_to_osm_tags and ONEWAY_TAG in tags:
+            copy_way = True
+        way_tags += tags
+
+    has_radweg_art = len(_find_all(feature, "radweg_art")) > 0
+    return FeatureAttributes(source, target, False, way_tags, copy_way, tuple(routes), has_radweg_art)
+
+
+AttributeHandler = Callable[[str], Tags]
+
+
+def _ignore(text: str) -> Tags:
+    return ()
+
+
+def _name(text: str) -> Tags:
+    return (("name", text),)
+
+
+def _width(text: str) -> Tags:
+    width_str = text
+    if float(width_str) >= 50:
+        width_str = str(float(width_str) / 10.0)
+    return (("width", width_str),)
+
+
+def _time_restriction(text: str) -> Tags:
+    """ marker for attributes which cause the feature to be discarded """
+    return ()
+
+
+def _routes(text: str) -> Tags:
+    """ marker for the attribute listing the routes a feature is part of """
+    return ()
+
+
+def _resolve_attribute_handler(tag: str) -> Optional[AttributeHandler]:
+    """ find the handler of an attribute by name, None if the attribute is unknown """
+    if "zeitbeschraenkung" in tag:
+        return _time_restriction
+    if "status" in tag:
+        return _ignore
+    elif "strassenname" in tag:
+        return _name
+    elif "radweg_art" in tag:
+        return radweg_art_to_osm_tags
+    elif "richtung" == tag:
+        return richtung_to_osm_tags
+    elif "oberflaeche" in tag:
+        return oberflaeche_to_osm_tags
+    elif "breite" in tag:
+        return _width
+    elif "niveau" in tag:
+        return niveau_to_osm_tags
+    elif "source" in tag or "target" in tag:
+        # todo decide if this info is relevant
+        return _ignore
+    elif "geom" in tag:
+        # already handled
+        return _ignore
+    elif "radrouten" == tag:
+        return _routes
+    elif "fuehrungsart" == tag:
+        # uncertain if tags with similar meaning exist in osm
+        return _ignore
+    elif "benutzungspflicht" == tag:
+        # todo detect traffic sign from it
+        return _ignore
+
+    # the following remaining attributes are redundant and/or don't add new relevant information
+    # mofa_frei:  is not relevant
+    # hindernis:  information already contained by other tags as "breite" and "radweg_art"
+    elif tag in ["klasse", "klasse_id", "netzklasse", "zweirichtung", "mofa_frei", "hindernis", "radweg_in_mittellage"]:
+        return _ignore
+    return None
+
+
+# handlers by exact attribute name, names not listed here are resolved once and added
+ATTRIBUTE_HANDLERS: Dict[str, Optional[AttributeHandler]] = {
+    name: _resolve_attribute_handler(name) for name in [
+        "zeitbeschraenkung", "status", "strassenname", "radweg_art", "richtung", "oberflaeche", "breite", "niveau",
+        "source", "target", "geom", "radrouten", "fuehrungsart", "benutzungspflicht", "klasse", "klasse_id",
+        "netzklasse", "zweirichtung", "mofa_frei", "hindernis", "radweg_in_mittellage",
+    ]
+}
+
+
+def attribute_handler(tag: str) -> Optional[AttributeHandler]:
+    try:
+        return ATTRIBUTE_HANDLERS[tag]
+    except KeyError:
+        handler = _resolve_attribute_handler(tag)
+        ATTRIBUTE_HANDLERS[tag] = handler
+        return handler
+
+
+def _find_all(feature: Element, tag: str) -> List[Element]:
+    count("xpath lookups")
+    return feature.findall(tag)
+
+
+def _first_text(feature: Element, tag: str) -> Optional[str]:
+    count("xpath lookups")
+    element = feature.find(tag)
+    return None if element is None else element.text
+
+
+def strip_namespaces(root: Element):
+    """ remove the namespace of the given element and all its descendants """
+    for elem in root.iter():
+        if not (isinstance(elem, etree._Comment) or isinstance(elem, etree._ProcessingInstruction)):
+            elem.tag = etree.QName(elem).localname
+    etree.cleanup_namespaces(root)
+
+
+# projection used by worker processes, created once per process
+_worker_converter: Optional[Converter] = None
+
+
+def parse_feature_members(feature_members: List[bytes]
+                          ) -> Tuple[List[Tuple[FeatureGeometry, FeatureAttributes]], Dict[str, int]]:
+    """
+    parse serialized featureMember elements, used as task of worker processes. the counters of the worker are
+    returned with the records, so the main process can add them to its own
+    """
+    global _worker_converter
+    if _worker_converter is None:
+        _worker_converter = Converter(DRN_PROJECTION, OSM_PROJECTION)
+
+    records = []
+    with counting() as counters:
+        for feature_member_xml in feature_members:
+            feature_member = etree.fromstring(feature_member_xml)
+            strip_namespaces(feature_member)
+            records.append(parse_feature(feature_member[0], _worker_converter))
+    return records, counters
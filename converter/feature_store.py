@@ -0,0 +1,55 @@
+from array import array
+from typing import List, Tuple
+
+GEOMETRY_MISSING = 0
+GEOMETRY_INVALID = 1
+GEOMETRY_VALID = 2
+
+
+class FeatureGeometryStore:
+    """
+    compact storage of the projected geometries of all drn features
+
+    features are addressed by their position in the dataset, the coordinates of all features are kept
+    in two flat arrays and each feature only stores the offset of its first coordinate
+    """
+
+    def __init__(self):
+        self.lats = array("d")
+        self.lons = array("d")
+        # coordinates of feature i are stored at [offsets[i], offsets[i + 1])
+        self.offsets = array("q", [0])
+        self.states = bytearray()
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def append(self, lats: List[float], lons: List[float]) -> int:
+        """ store the coordinates of the next feature and return its index """
+        self.lats.extend(lats)
+        self.lons.extend(lons)
+        self.offsets.append(len(self.lats))
+        self.states.append(GEOMETRY_VALID)
+        return len(self.states) - 1
+
+    def append_without_geometry(self, state: int = GEOMETRY_MISSING) -> int:
+        """ keep the position of a feature which doesn't define a usable geometry """
+        self.offsets.append(len(self.lats))
+        self.states.append(state)
+        return len(self.states) - 1
+
+    def state(self, index: int) -> int:
+        return self.states[index]
+
+    def get(self, index: int) -> Tuple[array, array]:
+        """ return latitudes and longitudes of the feature at the given index """
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.lats[start:end], self.lons[start:end]
+
+    def first(self, index: int) -> Tuple[float, float]:
+        start = self.offsets[index]
+        return self.lats[start], self.lons[start]
+
+    def last(self, index: int) -> Tuple[float, float]:
+        end = self.offsets[index + 1] - 1
+        return self.lats[end], self.lons[end]
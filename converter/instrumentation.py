@@ -0,0 +1,198 @@
+import cProfile
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+"""
+machine readable timings and counters of the conversion
+
+spans measure named sections of the code, either with the span context manager or the instrument decorator, and
+may be nested. counters (features parsed, nodes projected, sql round trips, bytes written, ...) are counted
+with count() and attributed to the spans of the same thread they were counted in. everything is written as a
+chrome trace, which can be opened in chrome://tracing or https://ui.perfetto.dev, totals per span name and of
+all counters are contained in its otherData
+
+with TRACE_MEMORY the peak of the memory allocated by python is recorded for every span using tracemalloc,
+which slows down the conversion noticeably. peaks are process wide, spans running at the same time in other
+threads share them. with PROFILE_STAGES every stage is additionally profiled with cProfile
+"""
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+logger.addHandler(logging.StreamHandler())
+
+load_dotenv()
+
+TRACE_FILEPATH = os.getenv("TRACE_FILEPATH") or "./resources/trace.json"
+# parsed like utils.get_bool_variable, which isn't imported since utils depends on modules using this one
+TRACE_MEMORY = (os.getenv("TRACE_MEMORY") or "false") in ("True", "true", "1", "t")
+PROFILE_STAGES = (os.getenv("PROFILE_STAGES") or "false") in ("True", "true", "1", "t")
+PROFILE_DIRECTORY = os.getenv("PROFILE_DIRECTORY") or "./resources/profiles"
+
+_lock = threading.Lock()
+_local = threading.local()
+# finished spans as chrome trace events
+_events: List[Dict] = []
+# counters of every thread, each dict is only written by its own thread
+_thread_counters: List[Dict[str, int]] = []
+# spans currently measuring memory, their peaks are kept when the tracemalloc peak is reset
+_memory_spans: List["_Span"] = []
+_start_ns = time.perf_counter_ns()
+
+
+class _Span:
+    def __init__(self, name: str, args: Dict):
+        self.name = name
+        self.args = args
+        self.memory_peak = 0
+
+
+def _counters() -> Dict[str, int]:
+    """ counters of the calling thread """
+    counters = getattr(_local, "counters", None)
+    if counters is None:
+        counters = _local.counters = dict()
+        with _lock:
+            _thread_counters.append(counters)
+    return counters
+
+
+def count(name: str, value: int = 1):
+    """ add :value to the counter :name, cheap enough to be used in loops """
+    counters = _counters()
+    counters[name] = counters.get(name, 0) + value
+
+
+def add_counters(counters: Dict[str, int]):
+    """ add counters collected elsewhere, e.g. in worker processes, to the counters of the calling thread """
+    for name, value in counters.items():
+        count(name, value)
+
+
+def counter_totals() -> Dict[str, int]:
+    with _lock:
+        thread_counters = [dict(counters) for counters in _thread_counters]
+    totals: Dict[str, int] = dict()
+    for counters in thread_counters:
+        for name, value in counters.items():
+            totals[name] = totals.get(name, 0) + value
+    return totals
+
+
+@contextmanager
+def counting() -> Iterator[Dict[str, int]]:
+    """ collect the counters counted inside the block, the yielded dict is filled when the block is left """
+    before = dict(_counters())
+    collected: Dict[str, int] = dict()
+    try:
+        yield collected
+    finally:
+        collected.update(_counter_difference(before, _counters()))
+
+
+def _counter_difference(before: Dict[str, int], after: Dict[str, int]) -> Dict[str, int]:
+    return {name: value - before.get(name, 0) for name, value in after.items() if value != before.get(name, 0)}
+
+
+@contextmanager
+def span(name: str, **args):
+    """ measure the enclosed block, :args are shown with the span in the trace """
+    current = _Span(name, args)
+    counters_before = dict(_counters())
+    if TRACE_MEMORY:
+        _start_memory_span(current)
+    start_ns = time.perf_counter_ns()
+    try:
+        yield current
+    finally:
+        end_ns = time.perf_counter_ns()
+        event_args = dict(current.args)
+        event_args.update(_counter_difference(counters_before, _counters()))
+        if TRACE_MEMORY:
+            event_args["memory_peak_mb"] = round(_end_memory_span(current) / (1024 * 1024), 1)
+        event = {"name": name, "ph": "X", "ts": (start_ns - _start_ns) / 1000, "dur": (end_ns - start_ns) / 1000,
+                 "pid": os.getpid(), "tid": threading.get_ident(), "args": event_args}
+        with _lock:
+            _events.append(event)
+
+
+def instrument(name: Optional[str] = None) -> Callable:
+    """ decorator measuring every call of a function as span, named after the function by default """
+    def decorator(function: Callable) -> Callable:
+        span_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _start_memory_span(current: _Span):
+    with _lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        # the peak is reset for the new span, so running spans keep the peak they have seen so far
+        peak = tracemalloc.get_traced_memory()[1]
+        for running in _memory_spans:
+            running.memory_peak = max(running.memory_peak, peak)
+        tracemalloc.reset_peak()
+        _memory_spans.append(current)
+
+
+def _end_memory_span(current: _Span) -> int:
+    with _lock:
+        _memory_spans.remove(current)
+        return max(current.memory_peak, tracemalloc.get_traced_memory()[1])
+
+
+@contextmanager
+def profile(name: str, enabled: bool = PROFILE_STAGES):
+    """ profile the enclosed block with cProfile and dump the stats to PROFILE_DIRECTORY/:name.prof """
+    if not enabled:
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # only one profiler can be active at a time since python 3.12, e.g. if stages run concurrently
+        logger.warning(f"Could not profile {name}: {e}")
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(PROFILE_DIRECTORY, exist_ok=True)
+        profiler.dump_stats(os.path.join(PROFILE_DIRECTORY, f"{name}.prof"))
+
+
+def write_trace(file_path: str = TRACE_FILEPATH):
+    """ write all finished spans as chrome trace with the totals per span name and of all counters """
+    with _lock:
+        events = list(_events)
+    summary: Dict[str, Dict] = dict()
+    for event in events:
+        span_summary = summary.setdefault(event["name"], {"calls": 0, "total_s": 0.0, "max_s": 0.0})
+        span_summary["calls"] += 1
+        span_summary["total_s"] = round(span_summary["total_s"] + event["dur"] / 1e6, 6)
+        span_summary["max_s"] = round(max(span_summary["max_s"], event["dur"] / 1e6), 6)
+        if "memory_peak_mb" in event["args"]:
+            span_summary["memory_peak_mb"] = max(span_summary.get("memory_peak_mb", 0), event["args"]["memory_peak_mb"])
+
+    directory = os.path.dirname(file_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(file_path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms",
+                   "otherData": {"spans": summary, "counters": counter_totals()}}, f)
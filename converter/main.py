@@ -1,16 +1,26 @@
 import logging
 
+import drn_transform
+import map_conflation
+import osm_extract
+import postgis_connector
+from boundary import HAMBURG_BOUNDARY_FILEPATH
+from drn_insert_node_tag import TAGGED_DRN_FILEPATH, WRITE_TAGGED_DRN
 from drn_transform import transform_drn_to_osm
-from map_conflation import conflate
+from map_conflation import conflate, load_osm_xml_data
 from osm_extract import extract_region_outside_hh, cut_osm_ways_after_border
+from osm_ids import OccupiedOsmIds
+from pipeline import Pipeline, PipelineContext, Stage, file_key
 from postgis_connector import find_matches
+from stage_cache import osm_node_digest
 
-""" 
+"""
 script to start from a original DRN Dataset and go through all steps necessary to create a dataset allowing routing
 inside hamburg with drn routes and fallback to osm data should routes cross the city border
 
 Depending on the used dataset sizes this takes several minutes, and will create intermediate datasets during the
-process.
+process. Steps whose inputs didn't change since the last run are skipped, see stage_cache.py. The extraction of
+the osm data and the transformation of the drn don't depend on each other and run at the same time, see pipeline.py.
 """
 
 logger = logging.getLogger(__name__)
@@ -18,19 +28,67 @@ logger.setLevel(logging.DEBUG)
 logger.addHandler(logging.StreamHandler())
 
 
-def main():
-    logger.info("Step 1: Transform DRN to OSM")
-    transform_drn_to_osm()
+def extract_and_cut(context: PipelineContext):
+    # the cut is done in place on the extracted file, so both steps are cached as one stage
+    osm_xml_data = cut_osm_ways_after_border(extract_region_outside_hh())
+    # the cut data is kept for the conflation, which would otherwise parse the written file again
+    context.put(file_key("osm_xml", osm_extract.OSM_RESULT_FILE_PATH), osm_xml_data)
+
 
-    logger.info("Step 2: Extract region outside Hamburg")
-    extract_region_outside_hh()
-    logger.info("Step 3: Cut OSM ways after border")
-    cut_osm_ways_after_border()
+def transform(context: PipelineContext):
+    # ids of the original osm data must not be used for drn elements. the extracted osm data only contains a subset
+    # of them, reading them from the original file allows the transformation to run before the extraction finished
+    transform_drn_to_osm(OccupiedOsmIds.from_files(osm_extract.OSM_FILE_PATH))
 
-    logger.info("Step 4: Find matches")
+
+def match(context: PipelineContext):
     find_matches()
-    logger.info("Step 5: Conflate")
-    conflate()
+
+
+def conflate_with_free_ids(context: PipelineContext):
+    osm_xml_data = context.take(file_key("osm_xml", map_conflation.OSM_FILE_PATH),
+                                lambda: load_osm_xml_data(map_conflation.OSM_FILE_PATH))
+    conflate(map_conflation.gather_occupied_osm_ids(), osm_xml_data)
+
+
+STAGES = [
+    Stage(
+        "extract", extract_and_cut,
+        inputs=(osm_extract.OSM_FILE_PATH, HAMBURG_BOUNDARY_FILEPATH),
+        outputs=(osm_extract.OSM_RESULT_FILE_PATH,),
+        sources=("osm_extract.py", "osm_index.py", "osm_writer.py", "map_conflation.py", "boundary.py",
+                 "projection.py")),
+    Stage(
+        "transform", transform,
+        inputs=(drn_transform.DRN_FILEPATH, osm_extract.OSM_FILE_PATH),
+        outputs=(drn_transform.TRANSFORMED_DRN_FILEPATH,) + ((TAGGED_DRN_FILEPATH,) if WRITE_TAGGED_DRN else ()),
+        sources=("drn_transform.py", "feature_parser.py", "mapping.py", "epsg_converter.py", "feature_store.py",
+                 "osm_store.py", "osm_writer.py", "osm_ids.py", "utils.py", "projection.py", "distance.py",
+                 "drn_insert_node_tag.py"),
+        env=("ENABLE_TRAVELLING_ONEWAY", "ONEWAY_TRAVEL_BY_SETTING_MAX_SPEED", "WRITE_TAGGED_DRN")),
+    # only drn nodes are matched, so changed tags in the transformed drn don't require new matches
+    Stage(
+        "match", match, dependencies=("extract", "transform"),
+        inputs=((postgis_connector.TRANSFORMED_DRN_FILEPATH, osm_node_digest), postgis_connector.OSM_FILE_PATH,
+                HAMBURG_BOUNDARY_FILEPATH),
+        outputs=(postgis_connector.MATCHES_FILE_PATH,),
+        sources=("postgis_connector.py", "memory_matcher.py", "drn_insert_node_tag.py", "utils.py",
+                 "boundary.py", "projection.py"),
+        env=("MATCH_BACKEND", "MATCHED_WAYS_PER_NODE")),
+    Stage(
+        "conflate", conflate_with_free_ids, dependencies=("extract", "transform", "match"),
+        inputs=(map_conflation.DRN_FILE_PATH, map_conflation.OSM_FILE_PATH, map_conflation.MATCHES_FILE_PATH,
+                HAMBURG_BOUNDARY_FILEPATH),
+        outputs=(map_conflation.OUT_FILE_PATH,),
+        sources=("map_conflation.py", "osm_index.py", "osm_ids.py", "osm_writer.py", "drn_transform.py", "utils.py",
+                 "boundary.py", "projection.py", "distance.py"),
+        env=("HELPER_POINT_SPACING", "NODE_MATCH_MAX_DISTANCE", "NODE_MATCH_CANDIDATES")),
+]
+
+
+def main():
+    logger.info("Extract the region outside Hamburg and transform the DRN, then find matches and conflate")
+    Pipeline(STAGES).run()
 
 
 if __name__ == '__main__':
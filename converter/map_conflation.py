@@ -1,24 +1,25 @@
 import json
-import math
 import os
-import subprocess
 import time
 from datetime import datetime
-from typing import Dict, List, Set
+from typing import Dict, List, Optional, Set, Tuple
 import logging
-import re
 
+import numpy as np
+import shapely
 from dotenv import load_dotenv
 from lxml import etree
 from lxml.etree import ElementTree
-from shapely.geometry import LineString
-from shapely.ops import transform
-from functools import partial
-import pyproj
+from scipy.spatial import cKDTree
 
 
-from drn_transform import haversine
-from utils import get_boundary_hamburg
+from boundary import hamburg_boundary
+from distance import planar_distance
+from instrumentation import count, instrument, span
+from osm_ids import OccupiedOsmIds
+from osm_index import OsmIndex
+from osm_writer import write_osm_tree
+from projection import METRIC_CRS, WGS84_CRS, project_coordinates
 
 """
 given drn-osm-node-ids and an osm-way-id matching candidate, search for the point
@@ -41,176 +42,269 @@ DRN_FILE_PATH = os.getenv("TRANSFORMED_DRN_FILEPATH") or "./resources/drn_as_osm
 OSM_FILE_PATH = os.getenv("OSM_CUT_FILEPATH") or "./resources/osm_with_hamburg_cut_out_medium.osm"
 MATCHES_FILE_PATH = os.getenv("MATCHES_FILE_PATH") or "./conflation/matches_concept_2_medium.json"
 
-OUT_FILE_PATH = "resources/osm_with_drn_conflated.osm"
+OUT_FILE_PATH = os.getenv("CONFLATED_OSM_FILEPATH") or "resources/osm_with_drn_conflated.osm.pbf"
 AUXILIARY_POINTS_FILE_PATH = "conflation/helper_points_medium.geojson"
+# distance in meters between helper points inserted into osm way segments crossing the boundary
+HELPER_POINT_SPACING = float(os.getenv("HELPER_POINT_SPACING") or 8)
 
+NODE_MATCHES_FILE_PATH = "conflation/node_matches.json"
+# drn nodes are replaced by the closest node of their matched osm ways if it is at most this many meters away
+NODE_MATCH_MAX_DISTANCE = float(os.getenv("NODE_MATCH_MAX_DISTANCE") or 8)
+# number of nearest osm nodes checked for belonging to a matched way before comparing all nodes of the ways
+NODE_MATCH_CANDIDATES = int(os.getenv("NODE_MATCH_CANDIDATES") or 8)
 
-def get_hamburg_boundary_line_string() -> LineString:
-    hamburg_boundary_line = LineString(get_boundary_hamburg())
-    project = partial(
-        pyproj.transform,
-        pyproj.Proj('EPSG:4326'),
-        pyproj.Proj('EPSG:32633'),
-        always_xy=True
-    )
-    hamburg_boundary_line_projected = transform(project, hamburg_boundary_line)
-    return hamburg_boundary_line_projected
 
-
-def conflate(occupied_osm_ids: Set[int]):
+def conflate(occupied_osm_ids: OccupiedOsmIds, osm_xml_data: Optional[ElementTree] = None):
+    """ :osm_xml_data is the already loaded content of OSM_FILE_PATH, it is modified in place """
     logger.info(f"Load data files and create acceleration data structures ({round(time.time() - start_time, 2)}s)")
 
     with open(MATCHES_FILE_PATH) as f:
         matches = json.load(f)
 
     drn_xml_data = load_osm_xml_data(DRN_FILE_PATH)
-    osm_xml_data = load_osm_xml_data(OSM_FILE_PATH)
+    if osm_xml_data is None:
+        osm_xml_data = load_osm_xml_data(OSM_FILE_PATH)
+
+    with span("index osm"):
+        osm_index = OsmIndex(osm_xml_data)
 
-    insert_osm_helper_points(osm_xml_data, matches, occupied_osm_ids)
+    insert_osm_helper_points(osm_index, matches, occupied_osm_ids)
 
-    drn_node_coord_mapping = create_node_id_to_coordinate_mapping(drn_xml_data)
-    osm_node_coord_mapping = create_node_id_to_coordinate_mapping(osm_xml_data)
+    with span("index drn nodes"):
+        drn_node_coord_mapping = create_node_id_to_coordinate_mapping(drn_xml_data)
 
     logger.info(f"Start conflation of {len(matches.keys())} items ({round(time.time() - start_time, 2)}s)")
 
-    ix = 0
-    for drn_node_id, osm_matches in matches.items():
-        if ix % 25 == 0:
-            logger.info(f"Matched {ix} elements")
-        ix += 1
+    # drn node id -> osm node id, all references get rewritten at once after matching
+    node_replacements = find_replacement_nodes(osm_index, drn_node_coord_mapping, matches)
 
-        drn_node_coord = drn_node_coord_mapping[drn_node_id]
-        osm_way_id = osm_matches[0][0]
+    logger.info(f"replace {len(node_replacements)} drn nodes in drn ways ({round(time.time() - start_time, 2)}s)")
+    replace_node_refs(drn_xml_data, node_replacements)
+
+    logger.info(f"append drn data to osm data file ({round(time.time() - start_time, 2)}s)")
+    with span("append drn data"):
+        append_osm_xml_data(osm_xml_data, drn_xml_data)
 
-        node_ids = get_node_ids_for_osm_way(osm_xml_data, osm_way_id)
-        if len(node_ids) == 0:
+    logger.info(f"write resulting osm data to file ({round(time.time() - start_time, 2)}s)")
+    # elements get written ordered by id since import in graphhopper fails otherwise
+    write_osm_tree(OUT_FILE_PATH, osm_xml_data.getroot())
+
+
+@instrument("match nodes")
+def find_replacement_nodes(osm_index: OsmIndex, drn_node_coord_mapping: Dict[str, Tuple[float, float]],
+                           matches: Dict, k: int = NODE_MATCH_CANDIDATES,
+                           max_distance: float = NODE_MATCH_MAX_DISTANCE) -> Dict[str, str]:
+    """
+    for every matched drn node find the closest osm node on one of its matched osm ways, drn nodes without
+    such a node within :max_distance meters are skipped
+
+    all drn nodes are searched at once in a kd-tree over the nodes of the matched ways, only the :k nearest nodes
+    are checked for belonging to a matched way. if none of them does, the nodes of the matched ways are compared
+    directly. the outcome for every drn node is written to NODE_MATCHES_FILE_PATH
+    """
+    # matched ways of every drn node as indices into way_ids
+    way_indices: Dict[str, int] = dict()
+    drn_node_ids, drn_way_indices = [], []
+    for drn_node_id, osm_matches in matches.items():
+        matched_way_indices = []
+        for osm_way_id, _ in osm_matches:
+            if len(get_node_ids_for_osm_way(osm_index, osm_way_id)) > 0:
+                matched_way_indices.append(way_indices.setdefault(str(osm_way_id), len(way_indices)))
+        drn_node_ids.append(drn_node_id)
+        drn_way_indices.append(matched_way_indices)
+
+    way_ids = list(way_indices.keys())
+
+    # candidate nodes are all nodes of the matched ways, the ways of node i are node_way_indices[i]
+    node_indices: Dict[str, int] = dict()
+    node_way_indices: List[Set[int]] = []
+    way_node_indices: List[np.ndarray] = []
+    for way_index, osm_way_id in enumerate(way_ids):
+        way_nodes = []
+        for node_id in osm_index.node_refs(osm_way_id):
+            if node_id not in node_indices:
+                node_indices[node_id] = len(node_indices)
+                node_way_indices.append(set())
+            node_way_indices[node_indices[node_id]].add(way_index)
+            way_nodes.append(node_indices[node_id])
+        way_node_indices.append(np.array(way_nodes))
+
+    node_replacements: Dict[str, str] = dict()
+    diagnostics = dict()
+    if len(node_indices) == 0:
+        for drn_node_id in drn_node_ids:
+            diagnostics[drn_node_id] = {"status": "no_way"}
+        _write_node_matches(diagnostics)
+        return node_replacements
+
+    osm_node_ids = list(node_indices.keys())
+    osm_coords = np.array([osm_index.node_coords[node_id] for node_id in osm_node_ids])
+    osm_points = np.column_stack(project_coordinates(osm_coords[:, 0], osm_coords[:, 1]))
+    drn_coords = np.array([drn_node_coord_mapping[drn_node_id] for drn_node_id in drn_node_ids])
+    drn_points = np.column_stack(project_coordinates(drn_coords[:, 0], drn_coords[:, 1]))
+
+    tree = cKDTree(osm_points)
+    candidate_distances, candidate_indices = tree.query(drn_points, k=min(k, len(osm_node_ids)))
+    candidate_distances = candidate_distances.reshape(len(drn_node_ids), -1).tolist()
+    candidate_indices = candidate_indices.reshape(len(drn_node_ids), -1).tolist()
+
+    for row, drn_node_id in enumerate(drn_node_ids):
+        matched_way_indices = set(drn_way_indices[row])
+        if len(matched_way_indices) == 0:
+            diagnostics[drn_node_id] = {"status": "no_way"}
             continue
 
-        # select closest node from precomputed node to coord data struct
-        min_distance = 100_000_000
-        min_distance_osm_node_id = -1
-
-        for i in range(len(node_ids)):
-            node_id = node_ids[i]
-            osm_node_coord = osm_node_coord_mapping[node_ids[i]]
-            distance = haversine(*osm_node_coord, *drn_node_coord)
-            if distance < min_distance:
-                min_distance = distance
-                min_distance_osm_node_id = node_id
-
-        min_distance_meter = min_distance * 1000
-        if min_distance_meter > 8:
-            logger.info(f"skip {drn_node_id} because it's to far away from it's match ({min_distance_meter}m, osm way id {osm_way_id})")
+        # candidates are ordered by distance, the first one on a matched way is the closest
+        node_index, distance = next(((candidate, candidate_distance) for candidate, candidate_distance
+                                     in zip(candidate_indices[row], candidate_distances[row])
+                                     if not node_way_indices[candidate].isdisjoint(matched_way_indices)), (-1, None))
+        if node_index < 0:
+            nodes = np.unique(np.concatenate([way_node_indices[way_index] for way_index in matched_way_indices]))
+            node_distances = planar_distance(*drn_points[row], *osm_points[nodes].T)
+            node_index, distance = int(nodes[np.argmin(node_distances)]), float(node_distances.min())
+
+        osm_way_id = way_ids[min(node_way_indices[node_index] & matched_way_indices)]
+        diagnostics[drn_node_id] = {"osm_node_id": osm_node_ids[node_index], "osm_way_id": osm_way_id,
+                                    "distance": distance}
+        if distance > max_distance:
+            logger.info(f"skip {drn_node_id} because it's to far away from it's match ({distance}m, osm way id {osm_way_id})")
+            diagnostics[drn_node_id]["status"] = "too_far"
             continue
-        else:
-            logger.info(f"matched osm way {osm_way_id}")
+        diagnostics[drn_node_id]["status"] = "matched"
+        node_replacements[drn_node_id] = osm_node_ids[node_index]
 
-        # update all occurrences of node id in drn data set
-        nd_references = drn_xml_data.xpath(f"way/nd[@ref='{drn_node_id}']")
-        for nd_ref in nd_references:
-            nd_ref.set("ref", str(min_distance_osm_node_id))
+    logger.info(f"matched {len(node_replacements)} of {len(drn_node_ids)} drn nodes with osm nodes")
+    _write_node_matches(diagnostics)
+    return node_replacements
 
-    logger.info(f"append drn data to osm data file ({round(time.time() - start_time, 2)}s)")
-    append_osm_xml_data(osm_xml_data, drn_xml_data)
 
-    logger.info(f"write resulting osm data to file ({round(time.time() - start_time, 2)}s)")
-    out_file_name = OUT_FILE_PATH
-    osm_xml_data.write(out_file_name, encoding='utf-8', xml_declaration=True, pretty_print=True)
-    # make sure osm file is properly ordered since import in graphhopper fails otherwise
-    subprocess.run([f"osmium sort ./{out_file_name} -o ./{out_file_name} --overwrite"], shell=True)
+def _write_node_matches(diagnostics: Dict[str, Dict]):
+    for diagnostic in diagnostics.values():
+        count(f"nodes {diagnostic['status']}")
+    with open(NODE_MATCHES_FILE_PATH, "w") as f:
+        json.dump(diagnostics, f)
 
 
-def get_node_ids_for_osm_way(osm_xml_data, osm_way_id) -> List[int]:
-    osm_way_ele = osm_xml_data.xpath(f"way[@id='{osm_way_id}']")
-    if len(osm_way_ele) == 0:
+def get_node_ids_for_osm_way(osm_index: OsmIndex, osm_way_id) -> List[str]:
+    if osm_index.way(osm_way_id) is None:
         logger.info(f"no way with id {osm_way_id} found")
         return []
-    osm_way_ele = osm_way_ele[0]
-    node_ids = []
-    for nd_ref_ele in osm_way_ele.iterchildren("nd"):
-        node_ids.append(nd_ref_ele.get("ref"))
-    return node_ids
-
-
-def insert_osm_helper_points(osm_xml_data, matches: Dict, occupied_osm_ids: Set[int]):
-    proj_to_32633 = get_projection_32633()
-    proj_to_4326 = get_projection_4326()
-    osm_node_coord_mapping = create_node_id_to_coordinate_mapping(osm_xml_data)
-    hamburg_boundary_line_string = get_hamburg_boundary_line_string()
-
-    helper_point_id = 0
-    while helper_point_id in occupied_osm_ids:
-        helper_point_id += 1
-        
-    geojson = {"type": "GeometryCollection", "geometries": []}
+    return osm_index.node_refs(osm_way_id)
+
+
+@instrument("replace node refs")
+def replace_node_refs(xml: ElementTree, node_replacements: Dict[str, str]):
+    """
+    update all occurrences of the replaced node ids in the ways of the data set in a single sweep,
+    drn and osm node ids don't overlap so a replacement never gets replaced again
+    """
+    if not node_replacements:
+        return
+    for way_element in xml.getroot().iterchildren(tag="way"):
+        for nd_element in way_element.iterchildren(tag="nd"):
+            replacement = node_replacements.get(nd_element.get("ref"))
+            if replacement is not None:
+                nd_element.set("ref", replacement)
+
+
+@instrument("insert helper points")
+def insert_osm_helper_points(osm_index: OsmIndex, matches: Dict, occupied_osm_ids: OccupiedOsmIds,
+                             spacing: float = HELPER_POINT_SPACING):
+    """
+    densify the segments of the matched osm ways which cross the boundary with a helper point every :spacing
+    meters, so drn nodes close to the border find an osm node nearby
+    """
+    osm_node_coord_mapping = osm_index.node_coords
 
     logger.info(f"Insert auxiliary points {len(matches.keys())} ({round(time.time() - start_time, 2)}s)")
 
-    osm_way_ids = [match[0][0] for match in matches.values()]
-    for idx, osm_way_id in enumerate(set(osm_way_ids)):
-        if idx % 25 == 0:
-            logger.info(f"at {idx}")
-
-        node_ids = get_node_ids_for_osm_way(osm_xml_data, osm_way_id)
-        osm_root = osm_xml_data.getroot()
-        osm_way_ele = osm_root.find(f"way[@id='{osm_way_id}']")
-
-        if len(node_ids) == 0:
+    # all segments of all matched ways, segment i of a way connects its nodes i and i + 1
+    way_ids, way_node_ids, segment_way_indices, segment_node_indices = [], [], [], []
+    # every matched way of a drn node may provide its replacement node, so all of them are densified
+    for osm_way_id in sorted(set(osm_way_id for match in matches.values() for osm_way_id, _ in match)):
+        node_ids = get_node_ids_for_osm_way(osm_index, osm_way_id)
+        if len(node_ids) < 2:
             continue
-
+        segment_way_indices.append(np.full(len(node_ids) - 1, len(way_ids)))
+        segment_node_indices.append(np.arange(len(node_ids) - 1))
+        way_ids.append(osm_way_id)
+        way_node_ids.append(node_ids)
+    if len(way_ids) == 0:
+        _write_helper_points([], [])
+        return
+
+    segment_way_indices = np.concatenate(segment_way_indices)
+    segment_node_indices = np.concatenate(segment_node_indices)
+    coords = np.array([osm_node_coord_mapping[node_id] for node_ids in way_node_ids for node_id in node_ids])
+    xs, ys = project_coordinates(coords[:, 0], coords[:, 1])
+    points = np.column_stack((xs, ys))
+    # index of the first node of every segment in the concatenated node coordinates
+    first_node_offsets = np.cumsum([0] + [len(node_ids) for node_ids in way_node_ids[:-1]])
+    segment_starts = first_node_offsets[segment_way_indices] + segment_node_indices
+    starts, ends = points[segment_starts], points[segment_starts + 1]
+
+    # test all segments against the boundary segments at once
+    segments = shapely.linestrings(np.stack((starts, ends), axis=1))
+    crossing = np.unique(hamburg_boundary(METRIC_CRS).segment_tree.query(segments, predicate="intersects")[0])
+
+    with span("densify segments", segments=len(crossing)):
+        helper_segments, helper_points = densify_segments(starts[crossing], ends[crossing], spacing)
+    count("helper points", len(helper_points))
+    helper_segments = crossing[helper_segments]
+    helper_lons, helper_lats = project_coordinates(helper_points[:, 0], helper_points[:, 1], METRIC_CRS, WGS84_CRS)
+    helper_lons, helper_lats = helper_lons.tolist(), helper_lats.tolist()
+
+    # helper points are ordered by way, segment and distance, which is the order their ids are assigned in
+    timestamp = datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ')
+    helper_ids = []
+    for lon, lat in zip(helper_lons, helper_lats):
+        helper_point_id = str(occupied_osm_ids.next_free_id("node"))
+        osm_index.add_node(helper_point_id, lon, lat, {"version": "1", "timestamp": timestamp})
+        helper_ids.append(helper_point_id)
+
+    # rebuild the node list of every densified way once, helper points go between both nodes of their segment
+    helper_ids_by_segment: Dict[int, List[str]] = dict()
+    for segment_index, helper_id in zip(helper_segments.tolist(), helper_ids):
+        helper_ids_by_segment.setdefault(segment_index, []).append(helper_id)
+    way_first_segments = np.cumsum([0] + [len(node_ids) - 1 for node_ids in way_node_ids[:-1]])
+    for way_index in np.unique(segment_way_indices[helper_segments]).tolist():
+        node_ids = way_node_ids[way_index]
+        first_segment = int(way_first_segments[way_index])
+        new_node_ids = [node_ids[0]]
         for i in range(1, len(node_ids)):
-            osm_node_coord = osm_node_coord_mapping[node_ids[i]]
-            last_node_coord = osm_node_coord_mapping[node_ids[i - 1]]
-
-            intersecting_segment_32633 = transform(proj_to_32633, LineString([last_node_coord, osm_node_coord]))
-            intersection_32633 = hamburg_boundary_line_string.intersection(intersecting_segment_32633)
-
-            if intersection_32633.is_empty:
-                continue
-
-            insert_idx = i + 1
-            for dist in range(8, math.floor(intersecting_segment_32633.length), 8):
-                new_point = intersecting_segment_32633.interpolate(dist)
-                new_point_back_projected = transform(proj_to_4326, new_point)
-                coords_new = [new_point_back_projected.xy[0][0], new_point_back_projected.xy[1][0]]
-                geojson['geometries'].append({"type": "Point", "coordinates": coords_new})
-
-                osm_way_ele.insert(insert_idx, etree.Element("nd", ref=str(helper_point_id)))
-                etree.SubElement(osm_root, "node", {
-                    "id": str(helper_point_id),
-                    "version": "1",
-                    "timestamp": datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    "lat": str(coords_new[1]),
-                    "lon": str(coords_new[0])
-                })
-
-                insert_idx += 1
-                helper_point_id += 1
-                while helper_point_id in occupied_osm_ids:
-                    helper_point_id += 1
-
+            new_node_ids.extend(helper_ids_by_segment.get(first_segment + i - 1, ()))
+            new_node_ids.append(node_ids[i])
+        osm_index.set_node_refs(way_ids[way_index], new_node_ids)
+
+    _write_helper_points(helper_lons, helper_lats)
+
+
+def densify_segments(starts: np.ndarray, ends: np.ndarray, spacing: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    points every :spacing meters along the projected segments from :starts to :ends, excluding both end points
+    and the last meter of a segment. returns the index of the segment of every point and the points itself
+    """
+    lengths = planar_distance(*starts.T, *ends.T)
+    # distances spacing, 2 * spacing, ... smaller than the floored segment length
+    counts = np.maximum(np.ceil((np.floor(lengths) - spacing) / spacing), 0).astype(np.int64)
+    segment_indices = np.repeat(np.arange(len(starts)), counts)
+    point_offsets = np.arange(len(segment_indices)) - np.repeat(np.cumsum(counts) - counts, counts)
+    distances = (point_offsets + 1) * spacing
+    fractions = (distances / lengths[segment_indices])[:, np.newaxis]
+    points = starts[segment_indices] + fractions * (ends - starts)[segment_indices]
+    return segment_indices, points
+
+
+def _write_helper_points(lons: List[float], lats: List[float]):
+    geojson = {"type": "GeometryCollection",
+               "geometries": [{"type": "Point", "coordinates": [lon, lat]} for lon, lat in zip(lons, lats)]}
     with open(AUXILIARY_POINTS_FILE_PATH, "w") as f:
         json.dump(geojson, f)
 
 
-def get_projection_32633():
-    return partial(
-        pyproj.transform,
-        pyproj.Proj('EPSG:4326'),
-        pyproj.Proj('EPSG:32633'),
-        always_xy=True)
-
-
-def get_projection_4326():
-    return partial(
-        pyproj.transform,
-        pyproj.Proj('EPSG:32633'),
-        pyproj.Proj('EPSG:4326'),
-        always_xy=True)
-
-
 def load_osm_xml_data(filepath: str) -> ElementTree:
-    return etree.parse(filepath)
+    with span("parse osm", file=filepath):
+        return etree.parse(filepath)
 
 
 def create_node_id_to_coordinate_mapping(xml: ElementTree):
@@ -226,21 +320,8 @@ def append_osm_xml_data(osm_xml_data: ElementTree, additional_xml_data: ElementT
         osm_xml_root.append(ele)
 
 
-def gather_occupied_osm_ids():
-    drn_file_path = DRN_FILE_PATH
-    osm_file_path = OSM_FILE_PATH
-    with open(osm_file_path, "r") as file:
-        osm_xml_data = file.read()
-    occupied_ids_osm = re.findall(r"\"[0-9]+\"", osm_xml_data)
-    with open(drn_file_path, "r") as file:
-        drn_xml_data = file.read()
-    occupied_ids_drn = re.findall(r"\"[0-9]+\"", drn_xml_data)
-    unique_occupied_ids = set()
-    for id in occupied_ids_osm:
-        unique_occupied_ids.add(int(id.replace("\"", "")))
-    for id in occupied_ids_drn:
-        unique_occupied_ids.add(int(id.replace("\"", "")))
-    return unique_occupied_ids
+def gather_occupied_osm_ids() -> OccupiedOsmIds:
+    return OccupiedOsmIds.from_files(OSM_FILE_PATH, DRN_FILE_PATH)
 
 if __name__ == '__main__':
     occupied_osm_ids = gather_occupied_osm_ids()
@@ -2,6 +2,7 @@ import os
 from typing import Dict
 
 from dotenv import load_dotenv
+from osm_store import Tags
 from utils import get_bool_variable
 
 load_dotenv()
@@ -180,33 +181,52 @@ niveau_mapping = {
 }
 
 
-def radweg_art_to_osm_tags(radweg_art: str) -> Dict:
-    if radweg_art not in radweg_art_mapping:
+def compile_mapping(mapping: Dict[str, Dict[str, str]]) -> Dict[str, Tags]:
+    """ turn the tag dictionaries of a mapping into tag tuples once, so they can be shared by all features """
+    return {value: tuple(tags.items()) for value, tags in mapping.items()}
+
+
+radweg_art_tags = compile_mapping(radweg_art_mapping)
+oberflaeche_tags = compile_mapping(oberflaeche_mapping)
+niveau_tags = compile_mapping(niveau_mapping)
+
+ONEWAY_TAG = ("oneway", "yes")
+if ONEWAY_TRAVEL_BY_SETTING_MAX_SPEED and ENABLE_TRAVELLING_ONEWAY:
+    # if a backward speed is supplied GraphHopper uses min(maxspeed, maxspeed:backward) as speed for both
+    # directions, from my understanding that's not a good evaluation see #2662 on graphhopper for possible
+    # feedback
+    _in_geometry_direction_tags: Tags = (("maxspeed:backward", "5"),)
+else:
+    _in_geometry_direction_tags: Tags = (ONEWAY_TAG,)
+richtung_tags = {
+    "in Geometrie-Richtung": _in_geometry_direction_tags,
+    "in beide Richtungen": (("oneway", "no"),),
+}
+
+
+def radweg_art_to_osm_tags(radweg_art: str) -> Tags:
+    tags = radweg_art_tags.get(radweg_art)
+    if tags is None:
         raise ValueError(f"Received an unexpected value for radweg_art '{radweg_art}' consider adding it to the mapping")
-    return radweg_art_mapping[radweg_art]
+    return tags
 
 
-def oberflaeche_to_osm_tags(oberflaeche: str) -> Dict:
-    if oberflaeche not in oberflaeche_mapping:
+def oberflaeche_to_osm_tags(oberflaeche: str) -> Tags:
+    tags = oberflaeche_tags.get(oberflaeche)
+    if tags is None:
         raise ValueError(f"Received an unexpected value for oberflaeche '{oberflaeche}' consider adding it to the mapping")
-    return oberflaeche_mapping[oberflaeche]
+    return tags
 
 
-def niveau_to_osm_tags(niveau: str) -> Dict:
-    if niveau not in niveau_mapping:
+def niveau_to_osm_tags(niveau: str) -> Tags:
+    tags = niveau_tags.get(niveau)
+    if tags is None:
         raise ValueError(f"Received an unexpected value for niveau '{niveau}' consider adding it to the mapping")
-    return niveau_mapping[niveau]
-
-
-def richtung_to_osm_tags(richtung: str) -> Dict:
-    if richtung == "in Geometrie-Richtung":
-        if ONEWAY_TRAVEL_BY_SETTING_MAX_SPEED and ENABLE_TRAVELLING_ONEWAY:
-            # if a backward speed is supplied GraphHopper uses min(maxspeed, maxspeed:backward) as speed for both
-            # directions, from my understanding that's not a good evaluation see #2662 on graphhopper for possible
-            # feedback
-            return {"maxspeed:backward": "5"}
-        else:
-            return {"oneway": "yes"}
-    if richtung == "in beide Richtungen":
-            return {"oneway": "no"}
-    raise ValueError(f"Unknown value for attribute 'richtung', was: {richtung}")
+    return tags
+
+
+def richtung_to_osm_tags(richtung: str) -> Tags:
+    tags = richtung_tags.get(richtung)
+    if tags is None:
+        raise ValueError(f"Unknown value for attribute 'richtung', was: {richtung}")
+    return tags
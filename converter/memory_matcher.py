@@ -0,0 +1,219 @@
+import json
+import logging
+import os
+import time
+from array import array
+from typing import Dict, List, Tuple
+
+import numpy as np
+import osmium
+import shapely
+from dotenv import load_dotenv
+from shapely.geometry import LineString
+
+from boundary import hamburg_boundary
+from instrumentation import count, span
+from projection import METRIC_CRS, project_coordinates
+
+"""
+in-process alternative to the postgis based matching of postgis_connector (concept 2)
+
+drn nodes close to the border of hamburg are matched with the closest osm highway line. instead of importing
+both datasets into postgis, the highway lines are read from the osm file, projected to epsg:32633 and put into
+an STRtree, so the border distance and the nearest line are computed for all drn nodes at once
+"""
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+logger.addHandler(logging.StreamHandler())
+
+load_dotenv()
+
+TRANSFORMED_DRN_FILEPATH = os.getenv("TRANSFORMED_DRN_FILEPATH") or "./resources/drn_as_osm.osm"
+OSM_FILE_PATH = os.getenv("OSM_CUT_FILEPATH") or "./resources/osm_with_hamburg_cut_out_medium.osm"
+MATCHES_FILE_PATH = os.getenv("MATCHES_FILE_PATH") or "./conflation/matches_concept_2_medium.json"
+
+DRN_NODES_NEAR_BORDER_FILE_PATH = "./conflation/drn_node_near_border.geojson"
+OSM_MATCHES_FILE_PATH = "./conflation/osm_matches_for_drn_points.geojson"
+
+# maximum distance in meters of drn nodes to the border of hamburg to be matched
+BORDER_DISTANCE = 20
+# candidate lines are first searched within this distance in meters, nodes without any candidate
+# fall back to an unbounded nearest neighbour search
+MATCH_SEARCH_RADIUS = 50
+# closest osm ways kept per drn node, the conflation picks the closest osm node on any of them
+MATCHED_WAYS_PER_NODE = int(os.getenv("MATCHED_WAYS_PER_NODE") or 3)
+
+
+class _DrnNodeHandler(osmium.SimpleHandler):
+    def __init__(self):
+        super().__init__()
+        self.ids = array("q")
+        self.lons = array("d")
+        self.lats = array("d")
+
+    def node(self, node):
+        self.ids.append(node.id)
+        self.lons.append(node.location.lon)
+        self.lats.append(node.location.lat)
+
+
+class _HighwayLineHandler(osmium.SimpleHandler):
+    """
+    collect the coordinates of all ways osm2pgsql would import into planet_osm_line with a highway tag,
+    the coordinates of way i are stored at [offsets[i], offsets[i + 1])
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.ids = array("q")
+        self.offsets = array("q", [0])
+        self.lons = array("d")
+        self.lats = array("d")
+
+    def way(self, way):
+        if "highway" not in way.tags or way.tags.get("area") == "yes":
+            return
+        locations = [node.location for node in way.nodes if node.location.valid()]
+        if len(locations) < 2:
+            return
+        self.ids.append(way.id)
+        for location in locations:
+            self.lons.append(location.lon)
+            self.lats.append(location.lat)
+        self.offsets.append(len(self.lons))
+
+
+class HighwayLines:
+    """ osm highway lines projected to epsg:32633 with a spatial index over them """
+
+    def __init__(self, handler: _HighwayLineHandler):
+        self.ids = np.frombuffer(handler.ids, dtype=np.int64)
+        self.offsets = np.frombuffer(handler.offsets, dtype=np.int64)
+        self.lons = np.frombuffer(handler.lons, dtype=np.float64)
+        self.lats = np.frombuffer(handler.lats, dtype=np.float64)
+
+        xs, ys = project_coordinates(self.lons, self.lats)
+        line_indices = np.repeat(np.arange(len(self.ids)), np.diff(self.offsets))
+        self.lines = shapely.linestrings(np.column_stack((xs, ys)), indices=line_indices)
+        self.tree = shapely.STRtree(self.lines)
+
+    def coordinates(self, index: int) -> List[List[float]]:
+        """ coordinates of the line in epsg:4326 as used in geojson """
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return np.column_stack((self.lons[start:end], self.lats[start:end])).tolist()
+
+
+def find_matches_in_memory():
+    start_time = time.time()
+
+    logger.info(f"load drn nodes ({round(time.time() - start_time, 2)}s)")
+    with span("load drn nodes"):
+        drn_nodes = _DrnNodeHandler()
+        drn_nodes.apply_file(TRANSFORMED_DRN_FILEPATH)
+    drn_ids = np.frombuffer(drn_nodes.ids, dtype=np.int64)
+    drn_lons = np.frombuffer(drn_nodes.lons, dtype=np.float64)
+    drn_lats = np.frombuffer(drn_nodes.lats, dtype=np.float64)
+
+    logger.info(f"load osm highway lines ({round(time.time() - start_time, 2)}s)")
+    with span("load osm highway lines"):
+        highway_line_handler = _HighwayLineHandler()
+        highway_line_handler.apply_file(OSM_FILE_PATH, locations=True)
+        highway_lines = HighwayLines(highway_line_handler)
+    count("drn nodes", len(drn_ids))
+    count("osm highway lines", len(highway_lines.ids))
+
+    logger.info(f"search drn nodes close to border ({round(time.time() - start_time, 2)}s)")
+    with span("search nodes close to border"):
+        drn_points = shapely.points(*project_coordinates(drn_lons, drn_lats))
+        near_border = nodes_close_to_border(drn_points, hamburg_boundary(METRIC_CRS).line, BORDER_DISTANCE)
+
+    logger.info(f"start searching matches. Nodes to match: {len(near_border)} ({round(time.time() - start_time, 2)}s)")
+    with span("match nodes", nodes=len(near_border)):
+        point_indices, line_indices, distances = nearest_lines(drn_points[near_border], highway_lines.tree)
+
+    near_border_ids = drn_ids[near_border].tolist()
+    # matches of every drn node ordered by distance
+    drn_id_to_matched_osm_ids: Dict[int, List[Tuple[int, float]]] = {drn_id: [] for drn_id in near_border_ids}
+    for point_index, line_index, distance in zip(point_indices.tolist(), line_indices.tolist(), distances.tolist()):
+        drn_id_to_matched_osm_ids[near_border_ids[point_index]].append((int(highway_lines.ids[line_index]), distance))
+
+    # store results for visualization and later use
+    logger.info(f"store matches as geojson files  ({round(time.time() - start_time, 2)}s)")
+    with span("write matches"):
+        write_feature_collection(DRN_NODES_NEAR_BORDER_FILE_PATH, [
+            _feature({"type": "Point", "coordinates": [lon, lat]}, {"drn_id": drn_id})
+            for drn_id, lon, lat in zip(near_border_ids, drn_lons[near_border].tolist(), drn_lats[near_border].tolist())
+        ])
+        # like the postgis backend only the closest match of every drn node is visualized
+        is_first = np.r_[True, point_indices[1:] != point_indices[:-1]] if len(point_indices) else point_indices
+        write_feature_collection(OSM_MATCHES_FILE_PATH, [
+            _feature({"type": "LineString", "coordinates": highway_lines.coordinates(line_index)},
+                     {"drn_id": near_border_ids[point_index], "osm_id": int(highway_lines.ids[line_index]),
+                      "distance": distance})
+            for point_index, line_index, distance in zip(point_indices[is_first].tolist(),
+                                                         line_indices[is_first].tolist(), distances[is_first].tolist())
+        ])
+        with open(MATCHES_FILE_PATH, "w") as f:
+            json.dump(drn_id_to_matched_osm_ids, f)
+    logger.info(f"finished matching ({round(time.time() - start_time, 2)}s)")
+
+
+def write_feature_collection(file_path: str, features: List[Dict]):
+    """ same layout as the feature collections written by the postgis backend """
+    with open(file_path, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+
+
+def _feature(geometry: Dict, properties: Dict) -> Dict:
+    return {"type": "Feature", "geometry": geometry, "properties": properties}
+
+
+def nodes_close_to_border(points: np.ndarray, boundary_line: LineString, max_distance: float) -> np.ndarray:
+    """ indices of the projected :points having a maximum distance of :max_distance to the :boundary_line """
+    return np.flatnonzero(shapely.dwithin(points, boundary_line, max_distance))
+
+
+def nearest_lines(points: np.ndarray, tree: shapely.STRtree, max_lines: int = MATCHED_WAYS_PER_NODE
+                  ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    the up to :max_lines closest lines in :tree for every point, returned as point indices, line indices and
+    distances ordered by point and distance. points without any line within MATCH_SEARCH_RADIUS only get their
+    single closest line, points are left out if the tree is empty
+
+    candidates within MATCH_SEARCH_RADIUS are resolved with a single bulk query, only the remaining points
+    need the more expensive nearest neighbour search
+    """
+    if len(points) == 0 or len(tree) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+
+    point_indices, candidate_indices = tree.query(points, predicate="dwithin", distance=MATCH_SEARCH_RADIUS)
+    candidate_distances = shapely.distance(points[point_indices], tree.geometries[candidate_indices])
+    # order by point and distance and keep the first :max_lines candidates of each point
+    order = np.lexsort((candidate_distances, point_indices))
+    point_indices, candidate_indices = point_indices[order], candidate_indices[order]
+    candidate_distances = candidate_distances[order]
+    positions = np.arange(len(point_indices))
+    is_first = np.r_[True, point_indices[1:] != point_indices[:-1]] if len(order) else order.astype(bool)
+    rank = positions - np.maximum.accumulate(np.where(is_first, positions, 0))
+    keep = rank < max_lines
+    point_indices, candidate_indices = point_indices[keep], candidate_indices[keep]
+    candidate_distances = candidate_distances[keep]
+
+    remaining = np.setdiff1d(np.arange(len(points)), point_indices)
+    if len(remaining) > 0:
+        (nearest_point_indices, nearest_indices), nearest_distances = tree.query_nearest(
+            points[remaining], return_distance=True, all_matches=False)
+        point_indices = np.concatenate((point_indices, remaining[nearest_point_indices]))
+        candidate_indices = np.concatenate((candidate_indices, nearest_indices))
+        candidate_distances = np.concatenate((candidate_distances, nearest_distances))
+        # stable, so the candidates of every point stay ordered by distance
+        order = np.argsort(point_indices, kind="stable")
+        point_indices, candidate_indices = point_indices[order], candidate_indices[order]
+        candidate_distances = candidate_distances[order]
+
+    return point_indices, candidate_indices, candidate_distances
+
+
+if __name__ == '__main__':
+    find_matches_in_memory()
@@ -1,18 +1,22 @@
 import logging
 import os
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 
+import numpy as np
+import shapely
 from dotenv import load_dotenv
 from lxml import etree
-from map_conflation import (create_node_id_to_coordinate_mapping,
-                            get_node_ids_for_osm_way, load_osm_xml_data)
-from postgis_connector import (boundary_line_as_32633, create_db,
-                               open_connection, update_projection)
+from lxml.etree import ElementTree
+from map_conflation import get_node_ids_for_osm_way, load_osm_xml_data
+from osm_index import OsmIndex
+from osm_writer import write_osm_tree
 from shapely.geometry import Point
-from shapely.geometry.polygon import LineString, Polygon
-from utils import (get_boundary_hamburg, get_osm_2_psql_host_param,
-                   get_psql_host_param)
+from shapely.geometry.polygon import Polygon
+from boundary import Boundary, hamburg_boundary
+from instrumentation import add_counters, count, counting, instrument, span
+from projection import METRIC_CRS, project_coordinates
 
 """
 extract an osm region which contains ways outside of hamburg but not within hamburg
@@ -27,14 +31,19 @@ logger.addHandler(logging.StreamHandler())
 
 load_dotenv()
 
-osm_2_psql_host_param = get_osm_2_psql_host_param()
-
 # OSM_FILE_PATH = "./resources/hamburg-latest_2022_05_16.osm"
 OSM_FILE_PATH = os.getenv("OSM_ORIGINAL_FILEPATH") or "./resources/hamburg_with_surroundings_medium.osm"
 OSM_RESULT_FILE_PATH = os.getenv("OSM_FILEPATH") or "./resources/osm_with_hamburg_cut_out_medium.osm"
 
+NODE_OUTSIDE = 0
+NODE_INSIDE = 1
+NODE_IN_SIMPLE_AREA = 2
+
+CUT_WORKERS = int(os.getenv("CUT_WORKERS") or os.cpu_count() or 1)
 
-def extract_region_outside_hh():
+
+def extract_region_outside_hh() -> ElementTree:
+    """ write the osm data outside of hamburg to OSM_RESULT_FILE_PATH and return it """
     logger.info("extract region outside hamburg")
 
     time_start = datetime.now()
@@ -43,10 +52,11 @@ def extract_region_outside_hh():
     simple_poly_2 = Polygon([[9.92, 53.57], [9.92, 53.62], [10.13, 53.63], [10.13, 53.57]])
 
     logger.info("Loading Hamburg boundary")
-    hamburg_boundary = Polygon(get_boundary_hamburg())
+    boundary = hamburg_boundary()
 
     osm_file_path = OSM_FILE_PATH
-    osm_xml_data = etree.parse(osm_file_path)
+    with span("parse osm", file=osm_file_path):
+        osm_xml_data = etree.parse(osm_file_path)
 
     root = osm_xml_data.getroot()
     logger.info(f"Loaded XML File with elements: {len(root)} ({datetime.now() - time_start})")
@@ -56,120 +66,203 @@ def extract_region_outside_hh():
     # second iteration is to go through every way build their geometry and test if the way should be excluded or cut
 
     logger.info("started indexing nodes and coordinates")
-    node_id_to_coordinate = dict()
-    for node_element in root.iterchildren(tag="node"):
-        node_id_to_coordinate[node_element.get("id")] = [node_element.get("lat"), node_element.get("lon")]
-    logger.info(f"finished indexing nodes and coordinates: {len(node_id_to_coordinate)} ({datetime.now() - time_start})")
+    with span("index nodes"):
+        node_id_to_index = dict()
+        lons, lats = [], []
+        for node_element in root.iterchildren(tag="node"):
+            node_id_to_index[node_element.get("id")] = len(lons)
+            lons.append(float(node_element.get("lon")))
+            lats.append(float(node_element.get("lat")))
+        count("osm nodes", len(lons))
+    logger.info(f"finished indexing nodes and coordinates: {len(node_id_to_index)} ({datetime.now() - time_start})")
+
+    # classify every node once instead of testing it again for every way referencing it
+    logger.info("started classifying nodes")
+    with span("classify nodes"):
+        node_classes = classify_nodes(np.array(lons), np.array(lats), [simple_poly_1, simple_poly_2], boundary.polygon).tolist()
+    logger.info(f"finished classifying nodes ({datetime.now() - time_start})")
 
     logger.info("started checking ways")
-    count = 0
-    for way_element in root.iterchildren(tag="way"):
-        point_refs = []
-        for nd_element in way_element.iterchildren(tag="nd"):
-            point_refs.append(nd_element.get("ref"))
-
-        all_inside = True
-        for point_ref in point_refs:
-            if point_ref not in node_id_to_coordinate:
-                break
+    with span("check ways"):
+        way_count, removed_count = 0, 0
+        for way_element in root.iterchildren(tag="way"):
+            all_inside = True
+            for nd_element in way_element.iterchildren(tag="nd"):
+                node_index = node_id_to_index.get(nd_element.get("ref"))
+                if node_index is None:
+                    break
+
+                node_class = node_classes[node_index]
+                if node_class == NODE_IN_SIMPLE_AREA:
+                    break
+
+                if node_class == NODE_OUTSIDE:
+                    all_inside = False
+                    break
+
+            if all_inside:
+                root.remove(way_element)
+                removed_count += 1
+
+            way_count += 1
+            if way_count % 10000 == 0:
+                logger.info(f"processed {way_count} ways ({datetime.now() - time_start})")
+        count("osm ways", way_count)
+        count("removed ways", removed_count)
 
-            point = Point(float(node_id_to_coordinate[point_ref][1]), float(node_id_to_coordinate[point_ref][0]))
-            if simple_poly_1.contains(point) or simple_poly_2.contains(point):
-                break
+    logger.info(f"finished checking ways ({datetime.now() - time_start})")
+    # only ways got removed, the remaining elements keep the order of the sorted input file
+    write_osm_tree(OSM_RESULT_FILE_PATH, root, presorted=True)
+    return osm_xml_data
 
-            inside = hamburg_boundary.contains(point)
-            if not inside:
-                all_inside = False
-                break
 
-        if all_inside:
-            root.remove(way_element)
+def classify_nodes(lons: np.ndarray, lats: np.ndarray, simple_polygons: List[Polygon], boundary: Polygon) -> np.ndarray:
+    """
+    classify all given coordinates at once: nodes inside one of the simple polygons (which lie completely within
+    hamburg) don't need an exact test, all others are tested against the prepared boundary polygon
+    """
+    in_simple_area = np.zeros(len(lons), dtype=bool)
+    for simple_polygon in simple_polygons:
+        shapely.prepare(simple_polygon)
+        in_simple_area |= shapely.contains_xy(simple_polygon, lons, lats)
 
-        count += 1
-        if count % 10000 == 0:
-            logger.info(f"processed {count} ways ({datetime.now() - time_start})")
+    shapely.prepare(boundary)
+    inside = np.zeros(len(lons), dtype=bool)
+    remaining = ~in_simple_area
+    count("exact boundary tests", int(remaining.sum()))
+    inside[remaining] = shapely.contains_xy(boundary, lons[remaining], lats[remaining])
 
-    logger.info(f"finished checking ways ({datetime.now() - time_start})")
-    tree = root.getroottree()
-    tree.write(OSM_RESULT_FILE_PATH, encoding='utf-8', xml_declaration=True, pretty_print=True)
+    node_classes = np.full(len(lons), NODE_OUTSIDE, dtype=np.int8)
+    node_classes[inside] = NODE_INSIDE
+    node_classes[in_simple_area] = NODE_IN_SIMPLE_AREA
+    return node_classes
 
 
-def cut_osm_ways_after_border():
+def cut_osm_ways_after_border(osm_xml_data: Optional[ElementTree] = None) -> ElementTree:
     """
     given an osm file containing ways that cross the given boundary, cut the ways which cross this boundary on the
-    first node that is inside the boundary polygon
+    first node that is inside the boundary polygon. the data is read from OSM_RESULT_FILE_PATH unless it is
+    given as :osm_xml_data, the result is written back to the file and returned
     """
     logger.info("cut osm ways after border")
 
-    # create postgis db with osm ways as "fast" approach to find ways crossing the border
-    subprocess.run([f'osm2pgsql {osm_2_psql_host_param} -d osm_cut --hstore --hstore-add-index {OSM_RESULT_FILE_PATH}'], shell=True)
-    conn, curs = open_connection("osm_cut")
+    if osm_xml_data is None:
+        osm_xml_data = load_osm_xml_data(OSM_RESULT_FILE_PATH)
+    with span("index osm"):
+        osm_index = OsmIndex(osm_xml_data)
+    osm_node_coord_mapping = osm_index.node_coords
+    boundary_ls = hamburg_boundary().line
 
-    update_projection(curs, conn, "planet_osm_line", "LineString")
-
-    hamburg_boundary_line_as_32633 = boundary_line_as_32633()
-
-    linestring_string = str(hamburg_boundary_line_as_32633)
-    curs.execute("""SELECT osm_id from planet_osm_line where st_dwithin(way_32633, 'SRID=32633;%s'::geometry, %s);""" % (linestring_string, 0))
-    osm_ways_on_border = curs.fetchall()
-    osm_ways_on_border = list(filter(lambda osm_id: osm_id > 0, [rec[0] for rec in osm_ways_on_border]))
+    # find ways crossing the border in process instead of importing the file into postgis
+    osm_ways_on_border = find_ways_crossing_boundary(osm_index, hamburg_boundary(METRIC_CRS))
 
     #
-    # with found osm ways on border go through the osm file and split ways from osm_ids found through postgis
+    # with found osm ways on border go through the osm file and split them
     #
 
-    osm_xml_data = load_osm_xml_data(OSM_RESULT_FILE_PATH)
-    osm_root = osm_xml_data.getroot()
-    osm_node_coord_mapping = create_node_id_to_coordinate_mapping(osm_xml_data)
-    boundary_ls = LineString(get_boundary_hamburg())
-
     count_idx = 0
     logger.info(f"Cutting {len(osm_ways_on_border)} ways")
-    for way_id in osm_ways_on_border:
-        osm_way_ele = osm_root.find(f"way[@id='{way_id}']")
-        if osm_way_ele is None:
-            logger.info(f"osm way with id {way_id} not found in loaded dataset")
-        node_ids = get_node_ids_for_osm_way(osm_xml_data, way_id)
-
-        logger.info(f"Cutting way {way_id} ({count_idx})")
-        count_idx += 1
-        node_coord = osm_node_coord_mapping[node_ids[0]]
-        is_last_inside = boundary_ls.contains(Point(node_coord))
-        for idx in range(1, len(node_ids)):
-            # check on which node the border is crossed and throw away everything before or after
-            node_id = node_ids[idx]
-            if node_id not in osm_node_coord_mapping:
-                break
-            node_coord = osm_node_coord_mapping[node_id]
-            is_inside = boundary_ls.contains(Point(node_coord))
-            if is_inside != is_last_inside:
-                if is_last_inside:
-                    # throw away points before
-                    for idx2 in range(0, idx):
-                        del_node_id = node_ids[idx2]
-                        nd_ele = osm_way_ele.find(f"nd[@ref='{del_node_id}']")
-                        osm_way_ele.remove(nd_ele)
-                else:
-                    # throw away points coming after
-                    if idx == len(node_ids) - 1:
-                        # we are already at the last node and there nothing to delete comes after it
-                        continue
-                    for idx2 in range(idx + 1, len(node_ids)):
-                        del_node_id = node_ids[idx2]
-                        nd_ele = osm_way_ele.find(f"nd[@ref='{del_node_id}']")
-                        osm_way_ele.remove(nd_ele)
-
-                # way got split continue with the next one
-                break
-
-    out_file_name = OSM_RESULT_FILE_PATH
-    osm_xml_data.write(out_file_name, encoding='utf-8', xml_declaration=True, pretty_print=True)
-
-    conn.close()
-    subprocess.run([f'dropdb {get_psql_host_param()} osm_cut'], shell=True)
+    count("cut ways", len(osm_ways_on_border))
+    with span("cut ways"):
+        for way_id in osm_ways_on_border:
+            node_ids = get_node_ids_for_osm_way(osm_index, way_id)
+
+            logger.info(f"Cutting way {way_id} ({count_idx})")
+            count_idx += 1
+            node_coord = osm_node_coord_mapping[node_ids[0]]
+            is_last_inside = boundary_ls.contains(Point(node_coord))
+            for idx in range(1, len(node_ids)):
+                # check on which node the border is crossed and throw away everything before or after
+                node_id = node_ids[idx]
+                if node_id not in osm_node_coord_mapping:
+                    break
+                node_coord = osm_node_coord_mapping[node_id]
+                is_inside = boundary_ls.contains(Point(node_coord))
+                if is_inside != is_last_inside:
+                    if is_last_inside:
+                        # throw away points before
+                        osm_index.set_node_refs(way_id, node_ids[idx:])
+                    else:
+                        # throw away points coming after
+                        if idx == len(node_ids) - 1:
+                            # we are already at the last node and there nothing to delete comes after it
+                            continue
+                        osm_index.set_node_refs(way_id, node_ids[:idx + 1])
+
+                    # way got split continue with the next one
+                    break
+
+    write_osm_tree(OSM_RESULT_FILE_PATH, osm_index.root, presorted=True)
+    return osm_xml_data
+
+
+@instrument("find ways crossing boundary")
+def find_ways_crossing_boundary(osm_index: OsmIndex, boundary: Boundary) -> List[int]:
+    """
+    return the ids of all line ways having at least one segment that touches or crosses the boundary line,
+    all way segments are tested at once against the index over the segments of the projected :boundary
+    """
+    way_ids = []
+    segment_way_indices = []
+    segment_coords = []
+    node_coords = osm_index.node_coords
+    for way_id, way_element in osm_index.ways.items():
+        node_refs = osm_index.way_node_refs[way_id]
+        if not _is_line_way(way_element, node_refs):
+            continue
+        coords = [node_coords[node_ref] for node_ref in node_refs if node_ref in node_coords]
+        if len(coords) < 2:
+            continue
+        segment_way_indices.extend([len(way_ids)] * (len(coords) - 1))
+        segment_coords.extend(zip(coords[:-1], coords[1:]))
+        way_ids.append(int(way_id))
+
+    if len(segment_coords) == 0:
+        return []
+
+    # distances are measured in a metric projection, as done previously by postgis
+    segment_coords = np.array(segment_coords, dtype=float)
+    xs, ys = project_coordinates(segment_coords[:, :, 0], segment_coords[:, :, 1])
+    segments = shapely.linestrings(np.stack([xs, ys], axis=-1))
+    boundary_tree = boundary.segment_tree
+
+    def query(chunk: np.ndarray) -> Tuple[np.ndarray, Dict[str, int]]:
+        # counters of pool threads would be missing from the stage counters, so they are added by the caller
+        with counting() as counters:
+            count("tested segments", len(chunk))
+            hits = chunk[boundary_tree.query(segments[chunk], predicate="intersects")[0]]
+        return hits, counters
+
+    # the segments are split into one chunk per core, shapely releases the gil while querying
+    chunks = [chunk for chunk in np.array_split(np.arange(len(segments)), CUT_WORKERS) if len(chunk) > 0]
+    with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+        results = list(executor.map(query, chunks))
+    for _, counters in results:
+        add_counters(counters)
+    crossing_segments = np.concatenate([hits for hits, _ in results])
+
+    crossing_way_indices = np.unique(np.asarray(segment_way_indices)[crossing_segments])
+    return [way_ids[way_index] for way_index in crossing_way_indices]
+
+
+def _is_line_way(way_element, node_refs: List[str]) -> bool:
+    """
+    approximates which ways osm2pgsql imports into planet_osm_line, which was queried for crossing ways before:
+    tagged ways that are either open or highways. the actual rules depend on the osm2pgsql style, known deviations:
+    - closed ways with only linear tags besides highway (e.g. barrier, waterway, railway) are lines for osm2pgsql
+      but are skipped here
+    - closed highways tagged area=yes are polygons for osm2pgsql but are kept here
+    - ways whose tags are all dropped by the style (e.g. only source or note) aren't imported by osm2pgsql but are
+      kept here
+    relations, which osm2pgsql imports with negative ids, were filtered out and aren't considered here either
+    """
+    tags = {tag.get("k"): tag.get("v") for tag in way_element.iterchildren(tag="tag")}
+    if len(tags) == 0:
+        return False
+    is_closed = len(node_refs) > 2 and node_refs[0] == node_refs[-1]
+    return not is_closed or "highway" in tags
 
 
 if __name__ == '__main__':
-    create_db('osm_cut')
     extract_region_outside_hh()
     cut_osm_ways_after_border()
@@ -0,0 +1,106 @@
+import re
+from array import array
+from typing import Dict, Iterable
+
+import numpy as np
+import osmium
+
+from osm_writer import is_pbf_file_path
+
+"""
+collect the ids already used in osm files so that newly created elements can be given free ids
+
+ids are only read from the id attribute of node, way and relation elements, each kind of element
+has its own id space as in osm itself
+"""
+
+OSM_ELEMENT_KINDS = ("node", "way", "relation")
+
+ID_PATTERN = re.compile(rb"<(node|way|relation)\s[^>]*?(?<=\s)id=[\"'](-?\d+)[\"']")
+CHUNK_SIZE = 16 * 1024 * 1024
+
+
+class OccupiedOsmIds:
+    """ sorted arrays of occupied ids per element kind with a cursor for allocating free ids """
+
+    def __init__(self, ids_by_kind: Dict[str, Iterable[int]]):
+        self.ids: Dict[str, np.ndarray] = {
+            kind: np.unique(np.asarray(ids_by_kind.get(kind, ()), dtype=np.int64)) for kind in OSM_ELEMENT_KINDS
+        }
+        # last allocated id and the position of the first occupied id not below it
+        self.cursors: Dict[str, int] = {kind: 0 for kind in OSM_ELEMENT_KINDS}
+        self.positions: Dict[str, int] = {kind: 0 for kind in OSM_ELEMENT_KINDS}
+
+    @classmethod
+    def from_ids(cls, node: Iterable[int] = (), way: Iterable[int] = (), relation: Iterable[int] = ()) -> "OccupiedOsmIds":
+        return cls({"node": list(node), "way": list(way), "relation": list(relation)})
+
+    @classmethod
+    def from_files(cls, *file_paths: str) -> "OccupiedOsmIds":
+        """ scan the given osm files and collect the ids of all their elements """
+        ids_by_kind = {kind: array("q") for kind in OSM_ELEMENT_KINDS}
+        for file_path in file_paths:
+            if is_pbf_file_path(file_path):
+                _scan_pbf_ids(file_path, ids_by_kind)
+            else:
+                _scan_xml_ids(file_path, ids_by_kind)
+        return cls(ids_by_kind)
+
+    def is_occupied(self, kind: str, osm_id: int) -> bool:
+        ids = self.ids[kind]
+        position = np.searchsorted(ids, osm_id)
+        return position < len(ids) and ids[position] == osm_id
+
+    def next_free_id(self, kind: str) -> int:
+        """ return the smallest id above the previously allocated one which isn't occupied """
+        ids = self.ids[kind]
+        candidate = self.cursors[kind] + 1
+        position = self.positions[kind]
+        while position < len(ids) and ids[position] < candidate:
+            position += 1
+        while position < len(ids) and ids[position] == candidate:
+            candidate += 1
+            position += 1
+        self.cursors[kind] = candidate
+        self.positions[kind] = position
+        return candidate
+
+
+def _scan_xml_ids(file_path: str, ids_by_kind: Dict[str, array]):
+    """ read the file in chunks and only pick the id attribute of node, way and relation start tags """
+    with open(file_path, "rb") as file:
+        remainder = b""
+        while True:
+            chunk = file.read(CHUNK_SIZE)
+            buffer = remainder + chunk
+            if not chunk:
+                end = len(buffer)
+            else:
+                # a tag can't contain "<", so everything before the last one only contains complete start tags
+                end = buffer.rfind(b"<")
+                if end == -1:
+                    end = len(buffer)
+            for kind, osm_id in ID_PATTERN.findall(buffer, 0, end):
+                ids_by_kind[kind.decode()].append(int(osm_id))
+            remainder = buffer[end:]
+            if not chunk:
+                break
+
+
+class _IdHandler(osmium.SimpleHandler):
+    def __init__(self, ids_by_kind: Dict[str, array]):
+        super().__init__()
+        self.ids_by_kind = ids_by_kind
+
+    def node(self, node):
+        self.ids_by_kind["node"].append(node.id)
+
+    def way(self, way):
+        self.ids_by_kind["way"].append(way.id)
+
+    def relation(self, relation):
+        self.ids_by_kind["relation"].append(relation.id)
+
+
+def _scan_pbf_ids(file_path: str, ids_by_kind: Dict[str, array]):
+    _IdHandler(ids_by_kind).apply_file(file_path)
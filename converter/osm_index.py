@@ -0,0 +1,51 @@
+from typing import Dict, List, Optional, Tuple
+
+from lxml import etree
+from lxml.etree import Element, ElementTree
+
+"""
+lookup structures for an osm xml document, built in a single pass over its elements
+
+ids are kept as strings, as they appear in the document, and coordinates as (lon, lat) tuples
+"""
+
+
+class OsmIndex:
+    def __init__(self, osm_xml_data: ElementTree):
+        self.osm_xml_data = osm_xml_data
+        self.root = osm_xml_data.getroot()
+
+        self.ways: Dict[str, Element] = dict()
+        self.node_coords: Dict[str, Tuple[float, float]] = dict()
+        self.way_node_refs: Dict[str, List[str]] = dict()
+
+        for element in self.root.iterchildren("node", "way"):
+            if element.tag == "node":
+                self.node_coords[element.get("id")] = (float(element.get("lon")), float(element.get("lat")))
+            else:
+                way_id = element.get("id")
+                self.ways[way_id] = element
+                self.way_node_refs[way_id] = [nd_element.get("ref") for nd_element in element.iterchildren("nd")]
+
+    def way(self, way_id) -> Optional[Element]:
+        return self.ways.get(str(way_id))
+
+    def node_refs(self, way_id) -> List[str]:
+        """ ids of the nodes referenced by the way, empty if the way doesn't exist """
+        return self.way_node_refs.get(str(way_id), [])
+
+    def set_node_refs(self, way_id, node_refs: List[str]):
+        """ replace all nd elements of a way at once, other children like tags are kept after them """
+        way_id = str(way_id)
+        way_element = self.ways[way_id]
+        other_children = [child for child in way_element if child.tag != "nd"]
+        way_element[:] = [etree.Element("nd", ref=node_ref) for node_ref in node_refs] + other_children
+        self.way_node_refs[way_id] = list(node_refs)
+
+    def add_node(self, node_id, lon: float, lat: float, attributes: Dict[str, str]) -> Element:
+        """ append a new node to the document and index its coordinate """
+        node_id = str(node_id)
+        node_element = etree.SubElement(self.root, "node", {"id": node_id, **attributes,
+                                                            "lat": str(lat), "lon": str(lon)})
+        self.node_coords[node_id] = (lon, lat)
+        return node_element
@@ -0,0 +1,134 @@
+from array import array
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+Tags = Tuple[Tuple[str, str], ...]
+Member = Tuple[str, int, str]
+
+
+def indices_by_id(ids: array) -> Sequence[int]:
+    """ positions of the given ids in ascending id order, ids are mostly appended in order already """
+    if all(ids[i] < ids[i + 1] for i in range(len(ids) - 1)):
+        return range(len(ids))
+    return sorted(range(len(ids)), key=ids.__getitem__)
+
+
+class TagTable:
+    """ interns tag tuples so that identical tag combinations are only kept once """
+
+    def __init__(self):
+        self.tag_sets: List[Tags] = []
+        self.ids: Dict[Tags, int] = dict()
+
+    def __len__(self) -> int:
+        return len(self.tag_sets)
+
+    def intern(self, tags: Tags) -> int:
+        tag_id = self.ids.get(tags)
+        if tag_id is None:
+            tag_id = len(self.tag_sets)
+            self.tag_sets.append(tags)
+            self.ids[tags] = tag_id
+        return tag_id
+
+    def get(self, tag_id: int) -> Tags:
+        return self.tag_sets[tag_id]
+
+
+class NodeStore:
+    """ osm nodes as parallel id, latitude and longitude arrays """
+
+    def __init__(self):
+        self.ids = array("q")
+        self.lats = array("d")
+        self.lons = array("d")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, node_id: int, lat: float, lon: float) -> int:
+        self.ids.append(node_id)
+        self.lats.append(lat)
+        self.lons.append(lon)
+        return len(self.ids) - 1
+
+    def __iter__(self) -> Iterator[Tuple[int, float, float]]:
+        return zip(self.ids, self.lats, self.lons)
+
+    def by_id(self) -> Iterator[Tuple[int, float, float]]:
+        for index in indices_by_id(self.ids):
+            yield self.ids[index], self.lats[index], self.lons[index]
+
+
+class WayStore:
+    """
+    osm ways with their node references kept in one flat array, the references of way i are
+    stored at [nd_offsets[i], nd_offsets[i + 1]), tags are referenced by their id in the tag table
+    """
+
+    def __init__(self, tag_table: TagTable):
+        self.tag_table = tag_table
+        self.ids = array("q")
+        self.nd_offsets = array("q", [0])
+        self.nd_refs = array("q")
+        self.tag_ids = array("l")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, way_id: int, node_refs: Sequence[int], tags: Tags) -> int:
+        self.ids.append(way_id)
+        self.nd_refs.extend(node_refs)
+        self.nd_offsets.append(len(self.nd_refs))
+        self.tag_ids.append(self.tag_table.intern(tags))
+        return len(self.ids) - 1
+
+    def node_refs(self, index: int) -> array:
+        return self.nd_refs[self.nd_offsets[index]:self.nd_offsets[index + 1]]
+
+    def tags(self, index: int) -> Tags:
+        return self.tag_table.get(self.tag_ids[index])
+
+    def __iter__(self) -> Iterator[Tuple[int, array, Tags]]:
+        for index in range(len(self.ids)):
+            yield self.ids[index], self.node_refs(index), self.tags(index)
+
+    def by_id(self) -> Iterator[Tuple[int, array, Tags]]:
+        for index in indices_by_id(self.ids):
+            yield self.ids[index], self.node_refs(index), self.tags(index)
+
+
+class RelationStore:
+    """ osm relations, there are only few of them so members are kept as plain tuples """
+
+    def __init__(self, tag_table: TagTable):
+        self.tag_table = tag_table
+        self.ids = array("q")
+        self.members: List[Tuple[Member, ...]] = []
+        self.tag_ids = array("l")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, relation_id: int, members: Sequence[Member], tags: Tags) -> int:
+        self.ids.append(relation_id)
+        self.members.append(tuple(members))
+        self.tag_ids.append(self.tag_table.intern(tags))
+        return len(self.ids) - 1
+
+    def __iter__(self) -> Iterator[Tuple[int, Tuple[Member, ...], Tags]]:
+        for index in range(len(self.ids)):
+            yield self.ids[index], self.members[index], self.tag_table.get(self.tag_ids[index])
+
+    def by_id(self) -> Iterator[Tuple[int, Tuple[Member, ...], Tags]]:
+        for index in indices_by_id(self.ids):
+            yield self.ids[index], self.members[index], self.tag_table.get(self.tag_ids[index])
+
+
+class OsmDataStore:
+    """ compact in-memory representation of an osm dataset, xml or pbf is only created when writing it """
+
+    def __init__(self):
+        self.tag_table = TagTable()
+        self.nodes = NodeStore()
+        self.ways = WayStore(self.tag_table)
+        self.relations = RelationStore(self.tag_table)
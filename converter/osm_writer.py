@@ -0,0 +1,125 @@
+import os
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+import osmium
+from lxml import etree
+from lxml.etree import Element
+
+from instrumentation import count, span
+
+"""
+output layer for osm data, elements are written ordered by type (nodes, ways, relations) and id
+which is what osm2pgsql and graphhopper expect, so no separate sorting step over the written file is needed
+
+the format is chosen by the file extension: paths ending with .pbf are written as compressed osm pbf,
+everything else as osm xml
+"""
+
+ELEMENT_ORDER = {"bounds": 0, "node": 1, "way": 2, "relation": 3}
+MEMBER_TYPES = {"node": "n", "way": "w", "relation": "r"}
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+DEFAULT_ROOT_ATTRIBUTES = {"version": "0.6", "generator": "DRN_Map_Transformer"}
+
+
+def is_pbf_file_path(file_path: str) -> bool:
+    return file_path.endswith(".pbf")
+
+
+def osm_element_sort_key(element: Element):
+    return ELEMENT_ORDER.get(element.tag, len(ELEMENT_ORDER)), int(element.get("id", 0))
+
+
+def write_osm_tree(file_path: str, osm_root: Element, presorted: bool = False):
+    """
+    write the children of an osm xml root element to file, unless :presorted is set
+    the elements get ordered by type and id first
+    """
+    elements = [element for element in osm_root if isinstance(element.tag, str)]
+    if not presorted:
+        elements.sort(key=osm_element_sort_key)
+    write_osm_elements(file_path, elements, dict(osm_root.attrib))
+
+
+def write_osm_elements(file_path: str, elements: Iterable[Element], root_attributes: Optional[Dict[str, str]] = None):
+    """
+    write osm xml elements to file in the given order, only the first bounds element is kept. if :elements is
+    a generator, the time spent producing them is part of the measured write
+    """
+    root_attributes = root_attributes or DEFAULT_ROOT_ATTRIBUTES
+    with span("write osm", file=file_path):
+        if is_pbf_file_path(file_path):
+            _write_pbf(file_path, elements, root_attributes)
+        else:
+            _write_xml(file_path, elements, root_attributes)
+        count("bytes written", os.path.getsize(file_path))
+
+
+def _write_xml(file_path: str, elements: Iterable[Element], root_attributes: Dict[str, str]):
+    with etree.xmlfile(file_path, encoding='utf-8') as xf:
+        xf.write_declaration()
+        with xf.element("osm", root_attributes):
+            xf.write("\n")
+            bounds_written = False
+            for element in elements:
+                if element.tag == "bounds":
+                    # bounds of merged datasets are only written once
+                    if bounds_written:
+                        continue
+                    bounds_written = True
+                xf.write(element, pretty_print=True, with_tail=False)
+
+
+def _write_pbf(file_path: str, elements: Iterable[Element], root_attributes: Dict[str, str]):
+    header = osmium.io.Header()
+    header.set("generator", root_attributes.get("generator", DEFAULT_ROOT_ATTRIBUTES["generator"]))
+
+    # the osmium writer refuses to overwrite existing files
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+    writer = None
+    try:
+        for element in elements:
+            if element.tag == "bounds":
+                if writer is None:
+                    header.add_box(osmium.osm.Box(
+                        osmium.osm.Location(float(element.get("minlon")), float(element.get("minlat"))),
+                        osmium.osm.Location(float(element.get("maxlon")), float(element.get("maxlat")))))
+                continue
+            if writer is None:
+                writer = osmium.SimpleWriter(file_path, 4 * 1024 * 1024, header)
+            if element.tag == "node":
+                writer.add_node(osmium.osm.mutable.Node(
+                    location=(float(element.get("lon")), float(element.get("lat"))), **_pbf_attributes(element)))
+            elif element.tag == "way":
+                node_refs = [int(nd.get("ref")) for nd in element.iterchildren("nd")]
+                writer.add_way(osmium.osm.mutable.Way(nodes=node_refs, **_pbf_attributes(element)))
+            elif element.tag == "relation":
+                members = [(MEMBER_TYPES[member.get("type")], int(member.get("ref")), member.get("role", ""))
+                           for member in element.iterchildren("member")]
+                writer.add_relation(osmium.osm.mutable.Relation(members=members, **_pbf_attributes(element)))
+        if writer is None:
+            writer = osmium.SimpleWriter(file_path, 4 * 1024 * 1024, header)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _pbf_attributes(element: Element) -> Dict:
+    attributes = {
+        "id": int(element.get("id")),
+        "tags": _tags(element),
+    }
+    for name in ("version", "changeset", "uid"):
+        if element.get(name) is not None:
+            attributes[name] = int(element.get(name))
+    if element.get("user") is not None:
+        attributes["user"] = element.get("user")
+    if element.get("timestamp") is not None:
+        attributes["timestamp"] = datetime.strptime(element.get("timestamp"), TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+    return attributes
+
+
+def _tags(element: Element) -> List:
+    return [(tag.get("k"), tag.get("v")) for tag in element.iterchildren("tag")]
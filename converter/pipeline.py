@@ -0,0 +1,242 @@
+import json
+import logging
+import os
+import resource
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from instrumentation import counting, profile, span, write_trace
+from stage_cache import StageCache, StageInput
+
+"""
+in-process orchestration of the conversion steps
+
+stages declare the stages they depend on and are started as soon as all of them finished, so independent
+stages run concurrently in threads of the same process. datasets loaded by one stage can be handed to later
+stages through the PipelineContext instead of writing and parsing them again. every stage still goes through
+the StageCache and is skipped if its inputs didn't change
+
+duration and peak memory of every stage are written to a json report. memory is sampled for the whole process,
+so stages running at the same time report the same peak. the counters of every stage are added to the report, and
+all spans are written as trace, see instrumentation.py
+"""
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+logger.addHandler(logging.StreamHandler())
+
+load_dotenv()
+
+PIPELINE_REPORT_FILEPATH = os.getenv("PIPELINE_REPORT_FILEPATH") or "./resources/pipeline_report.json"
+# maximum number of stages running at the same time
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS") or 2)
+# seconds between two samples of the memory usage
+MEMORY_SAMPLE_INTERVAL = 0.05
+
+
+class PipelineContext:
+    """ datasets shared between the stages of one pipeline run """
+
+    def __init__(self):
+        self.datasets: Dict[str, Any] = dict()
+        self.lock = threading.Lock()
+        self.key_locks: Dict[str, threading.Lock] = dict()
+
+    def put(self, key: str, dataset: Any):
+        with self.lock:
+            self.datasets[key] = dataset
+
+    def get(self, key: str, load: Callable[[], Any]) -> Any:
+        """ dataset stored under :key, it is loaded with :load and stored if no stage provided it yet """
+        with self._key_lock(key):
+            with self.lock:
+                if key in self.datasets:
+                    return self.datasets[key]
+            dataset = load()
+            self.put(key, dataset)
+            return dataset
+
+    def take(self, key: str, load: Callable[[], Any]) -> Any:
+        """ like get, but the dataset is removed from the context, for stages modifying it """
+        with self._key_lock(key):
+            with self.lock:
+                if key in self.datasets:
+                    return self.datasets.pop(key)
+            return load()
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self.lock:
+            return self.key_locks.setdefault(key, threading.Lock())
+
+
+def file_key(kind: str, file_path: str) -> str:
+    """ key of a dataset loaded from :file_path, so stages reading the same file find it independent of the path """
+    return f"{kind}:{os.path.abspath(file_path)}"
+
+
+class Stage(NamedTuple):
+    name: str
+    function: Callable[[PipelineContext], None]
+    dependencies: Tuple[str, ...] = ()
+    # used by the stage cache, see StageCache.run
+    inputs: Tuple[StageInput, ...] = ()
+    outputs: Tuple[str, ...] = ()
+    sources: Tuple[str, ...] = ()
+    env: Tuple[str, ...] = ()
+
+
+class _MemorySampler:
+    """ samples the resident memory of the process and tracks the peak while each stage is running """
+
+    def __init__(self, interval: float = MEMORY_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peaks: Dict[str, int] = dict()
+        self.running: set = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def start_stage(self, name: str):
+        with self.lock:
+            self.running.add(name)
+            self.peaks[name] = current_rss()
+
+    def end_stage(self, name: str) -> int:
+        self._update()
+        with self.lock:
+            self.running.discard(name)
+            return self.peaks[name]
+
+    def _sample(self):
+        while not self.stopped.wait(self.interval):
+            self._update()
+
+    def _update(self):
+        rss = current_rss()
+        with self.lock:
+            for name in self.running:
+                self.peaks[name] = max(self.peaks[name], rss)
+
+
+def current_rss() -> int:
+    """ resident memory of the process in bytes, the peak so far if the current value isn't available """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is given in kilobytes on linux and in bytes on macos
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if os.uname().sysname == "Darwin" else max_rss * 1024
+
+
+class Pipeline:
+    def __init__(self, stages: Iterable[Stage], stage_cache: Optional[StageCache] = None,
+                 workers: int = PIPELINE_WORKERS, report_file_path: str = PIPELINE_REPORT_FILEPATH):
+        self.stages: Dict[str, Stage] = {stage.name: stage for stage in stages}
+        self.stage_cache = stage_cache or StageCache()
+        self.workers = max(workers, 1)
+        self.report_file_path = report_file_path
+        self.context = PipelineContext()
+        self._validate()
+
+    def _validate(self):
+        """ all dependencies have to exist and must not form a cycle """
+        for stage in self.stages.values():
+            for dependency in stage.dependencies:
+                if dependency not in self.stages:
+                    raise ValueError(f"Stage {stage.name} depends on unknown stage {dependency}")
+        remaining = dict(self.stages)
+        while remaining:
+            ready = [name for name, stage in remaining.items() if all(d not in remaining for d in stage.dependencies)]
+            if len(ready) == 0:
+                raise ValueError(f"Stages {', '.join(remaining)} depend on each other")
+            for name in ready:
+                del remaining[name]
+
+    def run(self) -> Dict:
+        """ run all stages respecting their dependencies, raises the error of the first failed stage """
+        start_time = time.perf_counter()
+        report = {"stages": dict()}
+        finished: Dict[str, str] = dict()
+        errors: List[BaseException] = []
+        pending = dict(self.stages)
+        running: Dict[Future, str] = dict()
+
+        with _MemorySampler() as sampler, ThreadPoolExecutor(self.workers) as executor:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    dependency_states = [finished.get(dependency) for dependency in stage.dependencies]
+                    if any(state in ("failed", "not_run") for state in dependency_states):
+                        logger.warning(f"Stage {name} is not run since a stage it depends on failed")
+                        finished[name] = "not_run"
+                        report["stages"][name] = {"status": "not_run"}
+                        del pending[name]
+                    elif all(state is not None for state in dependency_states):
+                        running[executor.submit(self._run_stage, stage, sampler, start_time)] = name
+                        del pending[name]
+                if not running:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    stage_report, error = future.result()
+                    report["stages"][name] = stage_report
+                    finished[name] = stage_report["status"]
+                    if error is not None:
+                        errors.append(error)
+
+        report["duration_s"] = round(time.perf_counter() - start_time, 3)
+        report["peak_rss_mb"] = round(max([stage.get("peak_rss_mb", 0) for stage in report["stages"].values()] + [0]), 1)
+        self._write_report(report)
+        write_trace()
+        logger.info(f"Pipeline finished in {report['duration_s']}s, report written to {self.report_file_path}")
+        if errors:
+            raise errors[0]
+        return report
+
+    def _run_stage(self, stage: Stage, sampler: _MemorySampler, pipeline_start_time: float
+                   ) -> Tuple[Dict, Optional[BaseException]]:
+        logger.info(f"Start stage {stage.name}")
+        sampler.start_stage(stage.name)
+        start_time = time.perf_counter()
+        error = None
+        with counting() as counters, span(f"stage {stage.name}") as stage_span, profile(stage.name):
+            try:
+                ran = self.stage_cache.run(stage.name, lambda: stage.function(self.context), inputs=stage.inputs,
+                                           outputs=stage.outputs, sources=stage.sources, env=stage.env)
+                status = "ran" if ran else "skipped"
+            except Exception as e:
+                logger.exception(f"Stage {stage.name} failed")
+                status, error = "failed", e
+            stage_span.args["status"] = status
+        end_time = time.perf_counter()
+        peak_rss = sampler.end_stage(stage.name)
+        logger.info(f"Finished stage {stage.name} ({status}) in {round(end_time - start_time, 2)}s")
+        return {
+            "status": status,
+            "start_s": round(start_time - pipeline_start_time, 3),
+            "end_s": round(end_time - pipeline_start_time, 3),
+            "duration_s": round(end_time - start_time, 3),
+            "peak_rss_mb": round(peak_rss / (1024 * 1024), 1),
+            "counters": counters,
+        }, error
+
+    def _write_report(self, report: Dict):
+        directory = os.path.dirname(self.report_file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.report_file_path, "w") as f:
+            json.dump(report, f, indent=2)
@@ -1,31 +1,42 @@
+import argparse
 import json
 import logging
 import os
 import subprocess
+import threading
 import time
-from functools import partial
+from typing import Dict, List, Tuple
 
 import psycopg2
-import pyproj
+import psycopg2.extensions
+from boundary import hamburg_boundary
 from dotenv import load_dotenv
-from drn_insert_node_tag import insert_node_tag
+from drn_insert_node_tag import (TAGGED_DRN_FILEPATH, WRITE_TAGGED_DRN,
+                                 insert_node_tag, is_tagged_copy_current)
+from instrumentation import add_counters, count, counting, instrument, span
+from memory_matcher import MATCHED_WAYS_PER_NODE, find_matches_in_memory
+from projection import METRIC_CRS
 from psycopg2._psycopg import connection, cursor
 from shapely.geometry import LineString, Point
-from shapely.ops import transform
-from utils import (get_boundary_hamburg, get_osm_2_psql_host_param,
+from utils import (get_bool_variable, get_osm_2_psql_host_param,
                    get_psql_host_param)
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 logger.addHandler(logging.StreamHandler())
 
+load_dotenv()
+
 # specifies if databases should be created first and projections etc. be performed on it
-# only required on the first run
-init = True
+# only required on the first run, set POSTGIS_KEEP_DATABASES to keep them for later runs
+init = get_bool_variable("POSTGIS_INIT", True)
+keep_databases = get_bool_variable("POSTGIS_KEEP_DATABASES", False)
 # set to true if first concept should be executed, otherwise second approach is used
 use_concept_1 = False
 
-load_dotenv()
+# "postgis" matches via imported databases, "memory" in process without a database (concept 2 only)
+MATCH_BACKENDS = ("postgis", "memory")
+MATCH_BACKEND = os.getenv("MATCH_BACKEND") or "postgis"
 
 
 psql_host = os.getenv("POSTGRES_HOST")
@@ -42,7 +53,34 @@ OSM_FILE_PATH = os.getenv("OSM_CUT_FILEPATH") or "./resources/osm_with_hamburg_c
 DRN_TMP_FILE_PATH = "./resources/tmp_drn_as_osm.osm"
 MATCHES_FILE_PATH = os.getenv("MATCHES_FILE_PATH") or "./conflation/matches_concept_2_medium.json"
 
-def find_matches():
+# rows fetched per round trip when streaming match results from the server side cursor
+MATCH_FETCH_SIZE = 10_000
+# bytes read per chunk when streaming table data between databases
+COPY_BUFFER_SIZE = 1024 * 1024
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """ cursor counting every statement sent to the server as sql round trip """
+
+    def execute(self, query, vars=None):
+        count("sql round trips")
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        count("sql round trips")
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        count("sql round trips")
+        return super().copy_expert(sql, file, size)
+
+
+def find_matches(backend: str = MATCH_BACKEND):
+    if backend not in MATCH_BACKENDS:
+        raise Exception(f"Unknown match backend {backend}, expected one of {', '.join(MATCH_BACKENDS)}")
+    if backend == "memory":
+        find_matches_in_memory()
+        return
+
     start_time = time.time()
     if init:
         logger.info("setup db")
@@ -66,8 +104,9 @@ def find_matches():
 
     osm_conn.close()
     drn_conn.close()
-    subprocess.run([f'dropdb {psql_host_param} osm'], shell=True)
-    subprocess.run([f'dropdb {psql_host_param} drn'], shell=True)
+    if not keep_databases:
+        subprocess.run([f'dropdb {psql_host_param} osm'], shell=True)
+        subprocess.run([f'dropdb {psql_host_param} drn'], shell=True)
 
 
 def concept_1(osm_curs: cursor, start_time):
@@ -81,14 +120,10 @@ def concept_1(osm_curs: cursor, start_time):
 
     # store matches for later analysis
     logger.info(f"store matches as geojson files  ({round(time.time() - start_time, 2)}s)")
-    res = get_geojson_for_drn_matches(osm_curs, drn_way_id_to_matched_osm_ids)
-    with open("./conflation/drn_matches.geojson", "w") as f:
-        json.dump(res, f)
-    res = get_geojson_for_osm_matches(osm_curs, drn_way_id_to_matched_osm_ids)
-    with open("./conflation/osm_matches.geojson", "w") as f:
-        json.dump(res, f)
+    write_geojson_for_drn_matches(osm_curs, drn_way_id_to_matched_osm_ids, "./conflation/drn_matches.geojson")
+    write_geojson_for_osm_matches(osm_curs, drn_way_id_to_matched_osm_ids, "./conflation/osm_matches.geojson")
     with open("./conflation/matches_concept_1.json", "w") as f:
-        json.dump(res, f)
+        json.dump(drn_way_id_to_matched_osm_ids, f)
 
 
 def concept_2(osm_curs: cursor, start_time: float):
@@ -96,134 +131,201 @@ def concept_2(osm_curs: cursor, start_time: float):
 
     # retrieve drn nodes near border
     logger.info(f"search drn nodes close to border ({round(time.time() - start_time, 2)}s)")
-    drn_nodes_near_border = nodes_close_to_border(osm_curs, "drn_planet_osm_point", 20)
+    with span("search nodes close to border"):
+        drn_nodes_near_border = nodes_close_to_border(osm_curs, "drn_planet_osm_point", 20)
 
     # match found nodes with osm ways
     logger.info(f"start searching matches. Ways to match: {len(drn_nodes_near_border)} ({round(time.time() - start_time, 2)}s)")
-    drn_id_to_matched_osm_ids = calc_point_matches(osm_curs, drn_nodes_near_border)
+    with span("match nodes", nodes=len(drn_nodes_near_border)):
+        drn_id_to_matched_osm_ids = calc_point_matches(osm_curs, drn_nodes_near_border)
 
     # store results for visualization and later use
     logger.info(f"store matches as geojson files  ({round(time.time() - start_time, 2)}s)")
-    geojson = drn_nodes_to_geojson(osm_curs, drn_nodes_near_border)
-    with open("./conflation/drn_node_near_border.geojson", "w") as f:
-        json.dump(geojson, f)
-    res = get_geojson_for_osm_matches(osm_curs, drn_id_to_matched_osm_ids)
-    with open("./conflation/osm_matches_for_drn_points.geojson", "w") as f:
-        json.dump(res, f)
-    with open(MATCHES_FILE_PATH, "w") as f:
-        json.dump(drn_id_to_matched_osm_ids, f)
+    with span("write matches"):
+        write_geojson_for_drn_nodes(osm_curs, drn_nodes_near_border, "./conflation/drn_node_near_border.geojson")
+        write_geojson_for_osm_matches(osm_curs, drn_id_to_matched_osm_ids, "./conflation/osm_matches_for_drn_points.geojson")
+        with open(MATCHES_FILE_PATH, "w") as f:
+            json.dump(drn_id_to_matched_osm_ids, f)
 
 
 def calc_point_matches(osm_curs: cursor, drn_nodes_near_border):
     """ match found drn nodes with osm ways """
-    drn_id_to_matched_osm_ids = dict()
-
-    for idx, node in enumerate(drn_nodes_near_border):
-        query = f"""select ol.osm_id, st_distance(dp.way_32633, ol.way_32633) as distance 
-                           from planet_osm_line as ol 
-                           cross join drn_planet_osm_point as dp 
-                           where dp.osm_id = {node[0]} 
-                           and ol.highway is not null 
-                           order by distance limit 5;"""
-        osm_curs.execute(query)
-        matched_ways = osm_curs.fetchall()
-        max_idx = min(1, len(matched_ways))
-        drn_id_to_matched_osm_ids[node[0]] = matched_ways[:max_idx]
-        if idx % 10 == 0:
-            logger.info(f"{round(idx / len(drn_nodes_near_border) * 100, 2)} %")
-
-    return drn_id_to_matched_osm_ids
+    drn_ids = [node[0] for node in drn_nodes_near_border]
+    return calc_knn_matches(osm_curs, "drn_planet_osm_point", drn_ids, max(5, MATCHED_WAYS_PER_NODE))
 
 
 def calc_way_matches(osm_curs: cursor, drn_ways_near_border):
-    drn_id_to_matched_osm_ids = dict()
-
-    for idx, way in enumerate(drn_ways_near_border):
-        query = f"""select ol.osm_id, st_distance(dl.way_32633, ol.way_32633) as distance 
-                       from planet_osm_line as ol 
-                       cross join drn_planet_osm_line as dl 
-                       where dl.osm_id = {way[0]} 
-                       and ol.highway is not null 
-                       order by distance limit 50;"""
-        osm_curs.execute(query)
-        matched_ways = osm_curs.fetchall()
-        max_idx = min(1, len(matched_ways))
-        drn_id_to_matched_osm_ids[way[0]] = matched_ways[:max_idx]
-        if idx % 10 == 0:
-            logger.info(round(idx / len(drn_ways_near_border) * 100, 2), "%")
+    drn_ids = [way[0] for way in drn_ways_near_border]
+    drn_id_to_matched_osm_ids = calc_knn_matches(osm_curs, "drn_planet_osm_line", drn_ids, 50)
 
     logger.info(drn_id_to_matched_osm_ids)
     return drn_id_to_matched_osm_ids
 
 
-def get_geojson_for_drn_matches(curs: cursor, matches):
+def calc_knn_matches(osm_curs: cursor, drn_table_name: str, drn_ids: List[int], k: int,
+                     max_matches: int = MATCHED_WAYS_PER_NODE) -> Dict[int, List[Tuple[int, float]]]:
+    """
+    search the :k closest osm highway lines for all given drn geometries of :drn_table_name in a single query
+    and keep the :max_matches closest osm ways per drn geometry, ordered by distance
+
+    the <-> operator lets postgis walk the gist index on planet_osm_line.way_32633 per drn geometry
+    instead of sorting all lines, results are streamed through a server side cursor
+    """
+    drn_id_to_matched_osm_ids = {drn_id: [] for drn_id in drn_ids}
+    if len(drn_ids) == 0:
+        return drn_id_to_matched_osm_ids
+
+    match_curs = osm_curs.connection.cursor(name=f"{drn_table_name}_matches")
+    match_curs.itersize = MATCH_FETCH_SIZE
+    match_curs.execute(f"""SELECT d.osm_id, m.osm_id, m.distance
+                           FROM {drn_table_name} AS d
+                           CROSS JOIN LATERAL (
+                               SELECT ol.osm_id, st_distance(d.way_32633, ol.way_32633) AS distance
+                               FROM planet_osm_line AS ol
+                               WHERE ol.highway IS NOT NULL
+                               ORDER BY ol.way_32633 <-> d.way_32633
+                               LIMIT %s) AS m
+                           WHERE d.osm_id = ANY(%s);""", (k, drn_ids))
+
+    for idx, (drn_id, osm_id, distance) in enumerate(match_curs):
+        drn_id_to_matched_osm_ids[drn_id].append((osm_id, distance))
+        if idx % MATCH_FETCH_SIZE == 0:
+            # rows of the server side cursor are fetched in batches of itersize, each one a round trip
+            count("sql round trips")
+            logger.info(f"received {idx} candidates")
+    match_curs.close()
+    osm_curs.connection.commit()
+
+    for drn_id, matched_ways in drn_id_to_matched_osm_ids.items():
+        matched_ways.sort(key=lambda match: match[1])
+        # osm2pgsql splits long ways into several rows, only the closest row of every way is kept
+        seen_osm_ids = set()
+        matched_ways[:] = [match for match in matched_ways
+                           if match[0] not in seen_osm_ids and not seen_osm_ids.add(match[0])][:max_matches]
+
+    return drn_id_to_matched_osm_ids
+
+
+def write_geojson_for_drn_matches(curs: cursor, matches, file_path: str):
     """
-    transform a given dictionary of matches in form of drn_osm_id: [osm ids] pairs to geojson
-    containing the drn way geometries
+    write a given dictionary of matches in form of drn_osm_id: [(osm id, distance)] pairs as geojson
+    feature collection containing the drn way geometries
     """
-    drn_geometries = []
-    for drn_id, osm_matches in matches.items():
-        curs.execute(f"select st_asgeojson(st_transform(way_32633, 4326)) from drn_planet_osm_line where osm_id = {drn_id};")
-        drn_geometry = curs.fetchall()[0][0]
-        drn_geometries.append(json.loads(drn_geometry))
-    geojson = {
-        "type": "GeometryCollection",
-        "geometries": drn_geometries
-    }
-    return geojson
-
-
-def get_geojson_for_osm_matches(curs: cursor, matches):
+    drn_ids, osm_ids, distances = _first_matches(matches)
+    write_feature_collection_query(curs, file_path, """
+        SELECT d.way_32633 AS geometry, m.ordinality,
+               json_build_object('drn_id', m.drn_id, 'osm_id', m.osm_id, 'distance', m.distance) AS properties
+        FROM unnest(%s::bigint[], %s::bigint[], %s::float8[]) WITH ORDINALITY AS m(drn_id, osm_id, distance, ordinality)
+        CROSS JOIN LATERAL (SELECT way_32633 FROM drn_planet_osm_line WHERE osm_id = m.drn_id LIMIT 1) AS d""",
+                             (drn_ids, osm_ids, distances))
+
+
+def write_geojson_for_osm_matches(curs: cursor, matches, file_path: str):
+    """
+    write a given dictionary of matches in form of drn_osm_id: [(osm id, distance)] pairs as geojson
+    feature collection containing the osm way geometries of the first match
+    """
+    drn_ids, osm_ids, distances = _first_matches(matches)
+    write_feature_collection_query(curs, file_path, """
+        SELECT o.way_32633 AS geometry, m.ordinality,
+               json_build_object('drn_id', m.drn_id, 'osm_id', m.osm_id, 'distance', m.distance) AS properties
+        FROM unnest(%s::bigint[], %s::bigint[], %s::float8[]) WITH ORDINALITY AS m(drn_id, osm_id, distance, ordinality)
+        CROSS JOIN LATERAL (SELECT way_32633 FROM planet_osm_line WHERE osm_id = m.osm_id LIMIT 1) AS o""",
+                             (drn_ids, osm_ids, distances))
+
+
+def write_geojson_for_drn_nodes(curs: cursor, drn_nodes, file_path: str):
+    drn_ids = [rec[0] for rec in drn_nodes]
+    write_feature_collection_query(curs, file_path, """
+        SELECT d.way_32633 AS geometry, m.ordinality, json_build_object('drn_id', m.drn_id) AS properties
+        FROM unnest(%s::bigint[]) WITH ORDINALITY AS m(drn_id, ordinality)
+        CROSS JOIN LATERAL (SELECT way_32633 FROM drn_planet_osm_point WHERE osm_id = m.drn_id LIMIT 1) AS d""",
+                             (drn_ids,))
+
+
+def write_feature_collection_query(curs: cursor, file_path: str, features_query: str, params):
     """
-    transform a given dictionary of matches in form of drn_osm_id: [osm ids] pairs to geojson
-    containing the osm way geometries of the first match
+    aggregate the rows of :features_query (columns geometry, properties and ordinality) into a single geojson
+    feature collection on the server and write it to :file_path as is, without parsing it in python
     """
-    osm_geometries = []
-    for drn_id, osm_matches in matches.items():
-        curs.execute(f"select st_asgeojson(st_transform(way_32633, 4326)) from planet_osm_line where osm_id = {osm_matches[0][0]};")
-        osm_geometry = curs.fetchall()[0][0]
-        osm_geometries.append(json.loads(osm_geometry))
-    geojson = {
-        "type": "GeometryCollection",
-        "geometries": osm_geometries
-    }
-    return geojson
-
-
-def drn_nodes_to_geojson(curs: cursor, drn_nodes):
-    drn_geometries = []
-    for rec in drn_nodes:
-        drn_id = rec[0]
-        curs.execute(
-            f"select st_asgeojson(st_transform(way_32633, 4326)) from drn_planet_osm_point where osm_id = {drn_id};")
-        drn_geometry = curs.fetchall()[0][0]
-        drn_geometries.append(json.loads(drn_geometry))
-    geojson = {
-        "type": "GeometryCollection",
-        "geometries": drn_geometries
-    }
-    return geojson
+    curs.execute(f"""SELECT json_build_object(
+            'type', 'FeatureCollection',
+            'features', coalesce(json_agg(json_build_object(
+                'type', 'Feature',
+                'geometry', st_asgeojson(st_transform(f.geometry, 4326))::json,
+                'properties', f.properties) ORDER BY f.ordinality), '[]'::json))::text
+        FROM ({features_query}) AS f;""", params)
+    with open(file_path, "w") as f:
+        f.write(curs.fetchone()[0])
+
+
+def _first_matches(matches) -> Tuple[List[int], List[int], List[float]]:
+    """ split the first match of every drn id into parallel id and distance lists, drn ids without match are left out """
+    first_matches = [(drn_id, osm_matches[0][0], osm_matches[0][1])
+                     for drn_id, osm_matches in matches.items() if len(osm_matches) > 0]
+    return [m[0] for m in first_matches], [m[1] for m in first_matches], [m[2] for m in first_matches]
 
 
+@instrument("copy drn tables")
 def fill_osm_db_with_drn_data(drn_curs: cursor, osm_curs: cursor, osm_conn: connection):
     def copy_table(table_name: str):
         osm_curs.execute(f"CREATE TABLE drn_{table_name} AS SELECT * FROM {table_name} WHERE 1=0;")
         osm_conn.commit()
 
-        drn_curs.execute(f"select * from {table_name}")
-        drn_ways = drn_curs.fetchall()
-
-        logger.info(f"moving data from drn db to osm db, inserting {len(drn_ways)} rows")
-        for values in drn_ways:
-            placeholder_query = f"INSERT INTO drn_{table_name} VALUES ({', '.join('%s' for _ in range(len(values)))})"
-            query = osm_curs.mogrify(placeholder_query, tuple(values))
-            osm_curs.execute(query)
+        logger.info(f"moving {table_name} from drn db to osm db")
+        copy_between_connections(drn_curs, f"COPY {table_name} TO STDOUT (FORMAT binary)",
+                                 osm_curs, f"COPY drn_{table_name} FROM STDIN (FORMAT binary)")
         osm_conn.commit()
+        drn_curs.connection.commit()
 
     copy_table("planet_osm_line")
     copy_table("planet_osm_point")
 
+    # indexes aren't copied along with the table definition
+    create_spatial_index(osm_curs, osm_conn, "drn_planet_osm_line")
+    create_spatial_index(osm_curs, osm_conn, "drn_planet_osm_point")
+
 
+def copy_between_connections(source_curs: cursor, copy_to_query: str, target_curs: cursor, copy_from_query: str):
+    """
+    stream the output of a COPY ... TO STDOUT on one connection through a pipe into a COPY ... FROM STDIN
+    on another connection, rows are never materialized in python and memory usage is bounded by the pipe
+    """
+    read_fd, write_fd = os.pipe()
+    export_errors = []
+    # counted in the export thread, added to the counters of the calling thread once it finished
+    export_counters: Dict[str, int] = dict()
+
+    def export():
+        with counting() as counters:
+            try:
+                with os.fdopen(write_fd, "wb") as writer:
+                    source_curs.copy_expert(copy_to_query, writer, size=COPY_BUFFER_SIZE)
+            except Exception as e:
+                # also raised as broken pipe if the import failed and stopped reading
+                export_errors.append(e)
+        export_counters.update(counters)
+
+    export_thread = threading.Thread(target=export)
+    export_thread.start()
+    try:
+        with os.fdopen(read_fd, "rb") as reader:
+            target_curs.copy_expert(copy_from_query, reader, size=COPY_BUFFER_SIZE)
+    except Exception as e:
+        export_thread.join()
+        add_counters(export_counters)
+        # an export failing on its own ends the input of the import early, which then fails as well.
+        # a broken pipe on the other hand is only the consequence of the failed import
+        if export_errors and not isinstance(export_errors[0], BrokenPipeError):
+            raise e from export_errors[0]
+        raise
+    export_thread.join()
+    add_counters(export_counters)
+    if export_errors:
+        raise export_errors[0]
+
+
+@instrument("setup db")
 def setup_db():
     create_db("drn")
     create_db("osm")
@@ -233,12 +335,17 @@ def setup_db():
     # import osm file to created database
 
     # subprocess.run([f'osmium sort {TRANSFORMED_DRN_FILEPATH} -o {DRN_TMP_FILE_PATH}'], shell=True)
-    subprocess.run([f'cp {TRANSFORMED_DRN_FILEPATH} {DRN_TMP_FILE_PATH}'], shell=True)
     # prevent that osm2psql throws way nodes simply away when importing
-    logger.info(f"Insert node tags to prevent removal during importing")
-    insert_node_tag(DRN_TMP_FILE_PATH)
-    subprocess.run([f'osm2pgsql {osm_2_psql_host_param} -d "drn" --hstore --hstore-add-index {DRN_TMP_FILE_PATH}'], shell=True)
-    subprocess.run([f'rm "{DRN_TMP_FILE_PATH}"'], shell=True)
+    if WRITE_TAGGED_DRN and is_tagged_copy_current(TRANSFORMED_DRN_FILEPATH):
+        logger.info(f"Use nodes tagged during transformation from {TAGGED_DRN_FILEPATH}")
+        drn_import_file_path = TAGGED_DRN_FILEPATH
+    else:
+        logger.info(f"Insert node tags to prevent removal during importing")
+        insert_node_tag(TRANSFORMED_DRN_FILEPATH, DRN_TMP_FILE_PATH)
+        drn_import_file_path = DRN_TMP_FILE_PATH
+    subprocess.run([f'osm2pgsql {osm_2_psql_host_param} -d "drn" --hstore --hstore-add-index {drn_import_file_path}'], shell=True)
+    if drn_import_file_path == DRN_TMP_FILE_PATH:
+        os.remove(DRN_TMP_FILE_PATH)
 
     # --- import osm ---
     subprocess.run([f'osm2pgsql {osm_2_psql_host_param} -d "osm" --hstore --hstore-add-index {OSM_FILE_PATH}'], shell=True)
@@ -259,9 +366,10 @@ def create_db(db_name: str):
 
 def open_connection(db_name: str):
     if psql_host and psql_user and psql_pass:
-        conn = psycopg2.connect(database=db_name, host=psql_host, user=psql_user, password=psql_pass)
+        conn = psycopg2.connect(database=db_name, host=psql_host, user=psql_user, password=psql_pass,
+                                cursor_factory=CountingCursor)
     else:
-        conn = psycopg2.connect(database=db_name)
+        conn = psycopg2.connect(database=db_name, cursor_factory=CountingCursor)
     curs = conn.cursor()
     return conn, curs
 
@@ -276,13 +384,18 @@ def update_projection(curs: cursor, conn: connection, table_name: str, geometry_
     curs.execute(f"""ALTER TABLE {table_name} ADD COLUMN way_32633 geometry({geometry_type},32633);""")
     curs.execute(f"""UPDATE {table_name} SET way_32633 = ST_Transform(way, 32633);""")
     conn.commit()
+    create_spatial_index(curs, conn, table_name)
+
+
+def create_spatial_index(curs: cursor, conn: connection, table_name: str):
+    """ gist index on the projected geometries, used by st_dwithin and <-> nearest neighbour queries """
+    curs.execute(f"""CREATE INDEX IF NOT EXISTS {table_name}_way_32633_idx ON {table_name} USING GIST (way_32633);""")
+    curs.execute(f"""ANALYZE {table_name};""")
+    conn.commit()
 
 
 def ways_close_to_border(curs: cursor, table_name: str, max_distance: int):
-    project = partial(pyproj.transform, pyproj.Proj('EPSG:4326'), pyproj.Proj('EPSG:32633'), always_xy=True)
-    hamburg_boundary_line = LineString(get_boundary_hamburg())
-    hamburg_boundary_line_projected = transform(project, hamburg_boundary_line)
-    linestring_string = str(hamburg_boundary_line_projected)
+    linestring_string = str(boundary_line_as_32633())
 
     curs.execute("""SELECT osm_id 
         from %s 
@@ -292,11 +405,8 @@ def ways_close_to_border(curs: cursor, table_name: str, max_distance: int):
     return ways
 
 
-def boundary_line_as_32633():
-    project = partial(pyproj.transform, pyproj.Proj('EPSG:4326'), pyproj.Proj('EPSG:32633'), always_xy=True)
-    hamburg_boundary_line = LineString(get_boundary_hamburg())
-    hamburg_boundary_line_projected = transform(project, hamburg_boundary_line)
-    return hamburg_boundary_line_projected
+def boundary_line_as_32633() -> LineString:
+    return hamburg_boundary(METRIC_CRS).line
 
 
 def nodes_close_to_border(curs: cursor, table_name: str, max_distance: int):
@@ -314,4 +424,8 @@ def nodes_close_to_border(curs: cursor, table_name: str, max_distance: int):
 
 
 if __name__ == '__main__':
-    find_matches()
+    parser = argparse.ArgumentParser(description="find matches between drn nodes close to the border and osm ways")
+    parser.add_argument("--backend", choices=MATCH_BACKENDS, default=MATCH_BACKEND,
+                        help="where matches are computed, defaults to the MATCH_BACKEND environment variable or postgis")
+    args = parser.parse_args()
+    find_matches(args.backend)
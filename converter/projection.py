@@ -0,0 +1,94 @@
+import time
+from functools import lru_cache
+from typing import Tuple
+
+import numpy as np
+import shapely
+from instrumentation import count
+from pyproj import Transformer
+from shapely.geometry.base import BaseGeometry
+
+"""
+shared coordinate projections
+
+creating a Transformer builds the whole projection pipeline, which costs far more than projecting a few
+coordinates with it. transformers are therefore created once per pair of coordinate reference systems and
+geometries are projected with a single call over all of their coordinates
+"""
+
+WGS84_CRS = "EPSG:4326"
+# projection used for distance calculations (1 unit ~ 1 meter)
+METRIC_CRS = "EPSG:32633"
+
+
+@lru_cache(maxsize=None)
+def get_transformer(source_crs: str, target_crs: str, always_xy: bool = True) -> Transformer:
+    """ cached transformer from :source_crs to :target_crs, with always_xy coordinates are given as lon/lat """
+    return Transformer.from_crs(source_crs, target_crs, always_xy=always_xy)
+
+
+def project_coordinates(xs: np.ndarray, ys: np.ndarray, source_crs: str = WGS84_CRS,
+                        target_crs: str = METRIC_CRS) -> Tuple[np.ndarray, np.ndarray]:
+    xs, ys = np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)
+    count("projected coordinates", xs.size)
+    return get_transformer(source_crs, target_crs).transform(xs, ys)
+
+
+def project_geometry(geometry, source_crs: str = WGS84_CRS, target_crs: str = METRIC_CRS):
+    """ project a geometry or an array of geometries, all coordinates are projected at once """
+    transformer = get_transformer(source_crs, target_crs)
+
+    def project(coordinates: np.ndarray) -> np.ndarray:
+        count("projected coordinates", len(coordinates))
+        return np.column_stack(transformer.transform(coordinates[:, 0], coordinates[:, 1]))
+
+    return shapely.transform(geometry, project)
+
+
+def to_metric(geometry: BaseGeometry) -> BaseGeometry:
+    return project_geometry(geometry, WGS84_CRS, METRIC_CRS)
+
+
+def to_wgs84(geometry: BaseGeometry) -> BaseGeometry:
+    return project_geometry(geometry, METRIC_CRS, WGS84_CRS)
+
+
+def benchmark(segment_count: int = 2000):
+    """ compare projecting single border segments with pyproj.transform partials and with cached transformers """
+    import warnings
+    from functools import partial
+
+    import pyproj
+    from shapely.geometry import LineString
+    from shapely.ops import transform
+
+    rng = np.random.default_rng(0)
+    starts = np.column_stack((rng.uniform(9.7, 10.3, segment_count), rng.uniform(53.4, 53.7, segment_count)))
+    segments = [LineString([start, start + 0.001]) for start in starts]
+
+    timings = dict()
+    if hasattr(pyproj, "transform"):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            start_time = time.perf_counter()
+            for segment in segments:
+                # as previously done by map_conflation for every border segment
+                project = partial(pyproj.transform, pyproj.Proj(WGS84_CRS), pyproj.Proj(METRIC_CRS), always_xy=True)
+                transform(project, segment)
+            timings["pyproj.transform partial"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for segment in segments:
+        to_metric(segment)
+    timings["cached transformer"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    to_metric(np.array(segments, dtype=object))
+    timings["cached transformer, all segments at once"] = time.perf_counter() - start_time
+
+    for name, seconds in timings.items():
+        print(f"{name}: {seconds / segment_count * 1e6:.1f}us per segment")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Callable, Dict, Iterable, Optional, Tuple, Union
+
+import osmium
+from dotenv import load_dotenv
+
+from utils import get_bool_variable
+
+"""
+content addressed cache for the steps of the conversion pipeline
+
+every stage is identified by a key hashed from the contents of its input files, the source files of the
+modules it runs and the environment variables it depends on. a stage is skipped if its key is unchanged and
+its outputs still have the content recorded after its last run, so after changing e.g. a tag mapping only
+the affected stage and the stages depending on its outputs are recomputed
+
+file hashes are memoized by path, size and modification time so unchanged large files aren't read again.
+stages may be run from several threads at once. the manifest is only accessed while holding a lock, digests are
+computed without it so one stage hashing large inputs doesn't block the others
+"""
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+logger.addHandler(logging.StreamHandler())
+
+load_dotenv()
+
+STAGE_CACHE_FILEPATH = os.getenv("STAGE_CACHE_FILEPATH") or "./resources/stage_cache.json"
+USE_STAGE_CACHE = get_bool_variable("USE_STAGE_CACHE", True)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+SOURCE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# an input is either a file path hashed by content or a file path with a function computing its digest
+StageInput = Union[str, Tuple[str, Callable[[str], str]]]
+
+
+def file_digest(file_path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class _NodeDigestHandler(osmium.SimpleHandler):
+    def __init__(self):
+        super().__init__()
+        self.sha256 = hashlib.sha256()
+
+    def node(self, node):
+        self.sha256.update(f"{node.id},{node.location.lat},{node.location.lon};".encode())
+
+
+def osm_node_digest(file_path: str) -> str:
+    """ digest of the ids and locations of all nodes in an osm file, tags and metadata like timestamps are ignored """
+    handler = _NodeDigestHandler()
+    handler.apply_file(file_path)
+    return handler.sha256.hexdigest()
+
+
+class StageCache:
+    def __init__(self, manifest_file_path: str = STAGE_CACHE_FILEPATH, enabled: bool = USE_STAGE_CACHE):
+        self.manifest_file_path = manifest_file_path
+        self.enabled = enabled
+        self.manifest = {"files": dict(), "stages": dict()}
+        self.lock = threading.Lock()
+        if os.path.exists(manifest_file_path):
+            with open(manifest_file_path) as f:
+                self.manifest.update(json.load(f))
+
+    def digest(self, file_path: str, digest_function: Callable[[str], str] = file_digest) -> Optional[str]:
+        """ digest of a file computed by :digest_function, None if the file doesn't exist """
+        if not os.path.exists(file_path):
+            return None
+        stat = os.stat(file_path)
+        memo_key = f"{os.path.abspath(file_path)}#{digest_function.__name__}"
+        with self.lock:
+            memo = self.manifest["files"].get(memo_key)
+        if memo is not None and memo["size"] == stat.st_size and memo["mtime_ns"] == stat.st_mtime_ns:
+            return memo["digest"]
+        # threads racing for the same file both compute its digest, which yields the same result
+        digest = digest_function(file_path)
+        with self.lock:
+            self.manifest["files"][memo_key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "digest": digest}
+        return digest
+
+    def stage_key(self, name: str, inputs: Iterable[StageInput], outputs: Iterable[str],
+                  sources: Iterable[str], env: Iterable[str]) -> str:
+        description = {
+            "name": name,
+            "inputs": [self._input_digest(stage_input) for stage_input in inputs],
+            "outputs": list(outputs),
+            "sources": {source: self.digest(os.path.join(SOURCE_DIRECTORY, source)) for source in sources},
+            "env": {variable: os.getenv(variable) for variable in env},
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def is_fresh(self, name: str, key: str) -> bool:
+        """ a stage is fresh if it ran with the same key and its outputs weren't changed or removed since """
+        with self.lock:
+            stage = self.manifest["stages"].get(name)
+        if stage is None or stage["key"] != key:
+            return False
+        return all(self.digest(output) == digest for output, digest in stage["outputs"].items())
+
+    def run(self, name: str, stage_function: Callable[[], None], inputs: Iterable[StageInput] = (),
+            outputs: Iterable[str] = (), sources: Iterable[str] = (), env: Iterable[str] = ()) -> bool:
+        """ run :stage_function unless the stage is fresh, returns whether it was run """
+        inputs, outputs = list(inputs), list(outputs)
+        key = self.stage_key(name, inputs, outputs, sources, env)
+        if self.enabled and self.is_fresh(name, key):
+            logger.info(f"Skip stage {name}, its inputs are unchanged")
+            self._save()
+            return False
+
+        stage_function()
+
+        output_digests = {output: self.digest(output) for output in outputs}
+        with self.lock:
+            self.manifest["stages"][name] = {"key": key, "outputs": output_digests}
+        self._save()
+        return True
+
+    def _input_digest(self, stage_input: StageInput) -> Dict[str, Optional[str]]:
+        if isinstance(stage_input, str):
+            return {"path": stage_input, "digest": self.digest(stage_input)}
+        file_path, digest_function = stage_input
+        return {"path": file_path, "digest": self.digest(file_path, digest_function)}
+
+    def _save(self):
+        directory = os.path.dirname(self.manifest_file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_file_path = f"{self.manifest_file_path}.tmp"
+        # the lock is held until the file is replaced, so concurrent saves don't write the same tmp file
+        with self.lock:
+            with open(tmp_file_path, "w") as f:
+                json.dump(self.manifest, f, indent=2)
+            os.replace(tmp_file_path, self.manifest_file_path)
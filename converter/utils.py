@@ -1,19 +1,16 @@
-import json
 import os
 from math import asin, cos, radians, sin, sqrt
 from typing import List
 
+from boundary import boundary_coordinates
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
 def get_boundary_hamburg() -> List[List[float]]:
-    """ load a boundary coordinate list of hamburgs city outline """
-    with open("resources/hamburg_boundary.geojson") as f:
-        hamburg_boundary = json.load(f)
-    print("Loaded boundary of Hamburg")
-    return hamburg_boundary['geometries'][0]['coordinates'][0][0]
+    """ boundary coordinate list of hamburgs city outline, see boundary.py for prepared geometries """
+    return boundary_coordinates().tolist()
 
 
 def haversine(lon1, lat1, lon2, lat2):
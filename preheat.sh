@@ -10,7 +10,7 @@ echo "Preheating the docker image..."
 # Run GraphHopper in the background.
 java -Ddw.server.application_connectors[0].bind_host=0.0.0.0 \
     -Ddw.server.application_connectors[0].port=8989 \
-    -Ddw.graphhopper.datareader.file=./map.osm \
+    -Ddw.graphhopper.datareader.file=./map.osm.pbf \
     -jar /graphhopper/*.jar \
     server \
     /graphhopper/config-bike.yml &